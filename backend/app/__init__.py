@@ -1,20 +1,23 @@
 # app/__init__.py
 
 import os
+import time
+import logging
 from dotenv import load_dotenv
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
 from redis import Redis
-from sentence_transformers import CrossEncoder
 
 db = SQLAlchemy()
 redis_client = None
 
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__)
     load_dotenv()
+    from .registry import registry
 
     # CORS
     CORS(
@@ -36,13 +39,11 @@ def create_app():
     app.config['ALLOWED_EXTENSIONS'] = {e.strip().lower() for e in allowed.split(',') if e}
     app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 104857600))
 
-    # CROSS ENCODER
-    ce_model = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
-    app.cross_encoder = CrossEncoder(ce_model)
-
     # EXTENSIONS
     db.init_app(app)
     Migrate(app, db)
+    from .metrics import init_app as init_metrics
+    init_metrics(app)
 
     # REDIS CONFIG
     global redis_client
@@ -51,8 +52,23 @@ def create_app():
     # MODELS
     from .models import Document, Chunk
 
+    registry.record("startup:config", time.perf_counter() - started)
+
     # BLUEPRINTS
+    mark = time.perf_counter()
     from .routes import api
     app.register_blueprint(api)
+    registry.record("startup:blueprints", time.perf_counter() - mark)
+
+    # MODEL WARM-UP
+    # Models load lazily on first use. Listing them in WARMUP_MODELS loads them
+    # here instead; with `gunicorn --preload` that happens once in the master
+    # and forked workers share the weights copy-on-write.
+    warmup = [m.strip() for m in os.getenv("WARMUP_MODELS", "").split(",") if m.strip()]
+    if warmup:
+        registry.warm_up(warmup)
+
+    registry.record("startup:total", time.perf_counter() - started)
+    logging.info("Startup timings (s): " + ", ".join(f"{k}={v}" for k, v in registry.timings().items()))
 
     return app
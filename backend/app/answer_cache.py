@@ -0,0 +1,183 @@
+# app/answer_cache.py
+
+import os
+import json
+import time
+import logging
+import threading
+
+import numpy as np
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .embedder import get_query_embedding, redis_client
+from .generator import GENERATION_MODEL
+from .cache import TwoLevelCache, hash_key, normalize_question
+from .metrics import metrics
+
+# Configuration from environment
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") not in ("0", "false", "False")
+# Cosine similarity of two question embeddings that may share an answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_DOCS = int(os.getenv("ANSWER_CACHE_DOCS", "256"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+_GLOBAL_EPOCH = "answers:epoch"
+
+# Exact repeats, shared by every process; keys carry the epoch, so an
+# invalidation orphans old entries until their TTL runs out
+exact_cache = TwoLevelCache(
+    f"answers:{GENERATION_MODEL}",
+    redis_client,
+    max_items=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    dumps=lambda payload: json.dumps(payload).encode("utf-8"),
+    loads=lambda blob: json.loads(blob),
+)
+
+
+def _doc_epoch_key(doc_id: int) -> str:
+    return f"answers:epoch:{doc_id}"
+
+
+class _DocAnswers:
+    """
+    One document's cached answers in one mode: a row per question in an
+    embedding matrix, searched with a single matrix-vector product. Least
+    recently used rows go first once ANSWER_CACHE_SIZE is reached.
+    """
+
+    def __init__(self, epoch: str):
+        self.epoch = epoch
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._keys = None
+        self._matrix = None
+
+    def match(self, q: np.ndarray) -> Optional[Tuple[dict, float]]:
+        now = time.monotonic()
+        expired = [key for key, (_, expires, _) in self.entries.items() if expires <= now]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self._matrix = None
+        if not self.entries:
+            return None
+
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.stack([self.entries[key][0] for key in self._keys])
+        sims = self._matrix @ q
+        best = int(np.argmax(sims))
+        if sims[best] < ANSWER_CACHE_THRESHOLD:
+            return None
+        key = self._keys[best]
+        self.entries.move_to_end(key)
+        return self.entries[key][2], float(sims[best])
+
+    def add(self, key: str, q: np.ndarray, payload: dict):
+        self.entries[key] = (q, time.monotonic() + ANSWER_CACHE_TTL, payload)
+        self.entries.move_to_end(key)
+        while len(self.entries) > ANSWER_CACHE_SIZE:
+            self.entries.popitem(last=False)
+        self._matrix = None
+
+
+_stores: "OrderedDict[Tuple[int, str], _DocAnswers]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _epoch(doc_id: int) -> Optional[str]:
+    """Global and per-document invalidation counters; None when Redis can't say."""
+    try:
+        glob, doc = redis_client.mget([_GLOBAL_EPOCH, _doc_epoch_key(doc_id)])
+    except Exception as e:
+        logging.warning(f"Answer cache epoch lookup failed, bypassing the cache: {e}")
+        return None
+    return f"{int(glob or 0)}.{int(doc or 0)}"
+
+
+def _embed(question: str) -> Optional[np.ndarray]:
+    # Served from the query embedding cache, and retrieval reuses it on a miss
+    try:
+        q = get_query_embedding(question)[0]
+    except Exception as e:
+        logging.warning(f"Answer cache can't embed the question, bypassing the cache: {e}")
+        return None
+    return q / (np.linalg.norm(q) + 1e-12)
+
+
+def _exact_key(doc_id: int, question: str, mode: str, epoch: str) -> str:
+    return hash_key(normalize_question(question), doc_id, mode, epoch)
+
+
+def _store_for(doc_id: int, mode: str, epoch: str) -> _DocAnswers:
+    with _lock:
+        answers = _stores.get((doc_id, mode))
+        if answers is None or answers.epoch != epoch:
+            answers = _stores[(doc_id, mode)] = _DocAnswers(epoch)
+        _stores.move_to_end((doc_id, mode))
+        while len(_stores) > ANSWER_CACHE_DOCS:
+            _stores.popitem(last=False)
+        return answers
+
+
+def lookup(doc_id: int, question: str, mode: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    A cached answer to `question`, or a paraphrase of it, about `doc_id`.
+    Returns (payload or None, epoch); pass the epoch back to store() so an
+    answer computed across an invalidation is never cached.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    epoch = _epoch(doc_id)
+    if epoch is None:
+        return None, None
+
+    q = _embed(question)
+    if q is None:
+        return None, None
+    answers = _store_for(doc_id, mode, epoch)
+    with _lock:
+        found = answers.match(q)
+    if found is not None:
+        payload, similarity = found
+        metrics.inc("cache_lookups_total", cache="answers_semantic", result="hit")
+        logging.debug(f"Answer cache hit for document {doc_id} at similarity {similarity:.3f}.")
+        return payload, epoch
+    metrics.inc("cache_lookups_total", cache="answers_semantic", result="miss")
+
+    # Another process may have answered the very same question
+    key = _exact_key(doc_id, question, mode, epoch)
+    payload = exact_cache.get(key)
+    if payload is not None:
+        with _lock:
+            answers.add(key, q, payload)
+    return payload, epoch
+
+
+def store(doc_id: int, question: str, mode: str, epoch: Optional[str], payload: Dict):
+    """Cache `payload` (answer, citations, ...) for `question` under the epoch lookup() returned."""
+    if epoch is None or _epoch(doc_id) != epoch:
+        return
+    key = _exact_key(doc_id, question, mode, epoch)
+    q = _embed(question)
+    if q is None:
+        return
+    answers = _store_for(doc_id, mode, epoch)
+    with _lock:
+        answers.add(key, q, payload)
+    exact_cache.set(key, payload)
+
+
+def invalidate(doc_id: Optional[int] = None):
+    """Drop cached answers of `doc_id`, or of every document, in all processes."""
+    with _lock:
+        for key in [k for k in _stores if doc_id is None or k[0] == doc_id]:
+            del _stores[key]
+    exact_cache.clear_local()
+    try:
+        redis_client.incr(_GLOBAL_EPOCH if doc_id is None else _doc_epoch_key(doc_id))
+    except Exception as e:
+        logging.warning(f"Answer cache invalidation failed: {e}")
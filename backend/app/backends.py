@@ -0,0 +1,87 @@
+# app/backends.py
+
+import os
+import shutil
+import logging
+import threading
+
+# Configuration from environment
+# Exports go under the index root, which every container mounts
+_INDEX_ROOT = os.path.dirname(os.getenv("FAISS_INDEX_DIR", "indexes/faiss_index").rstrip("/")) or "."
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", os.path.join(_INDEX_ROOT, "onnx"))
+
+# torch: fp32 PyTorch; int8: PyTorch with dynamically quantized Linear layers;
+# onnx: ONNX Runtime graph exported through optimum (optional dependency:
+# pip install "optimum[onnxruntime]", see requirements.txt)
+BACKENDS = ("torch", "int8", "onnx")
+
+_TORCH_CLASSES = {
+    "feature-extraction": "AutoModel",
+    "text2text-generation": "AutoModelForSeq2SeqLM",
+}
+
+_ORT_CLASSES = {
+    "feature-extraction": "ORTModelForFeatureExtraction",
+    "text2text-generation": "ORTModelForSeq2SeqLM",
+}
+
+
+def backend_for(component: str) -> str:
+    """Backend of one component: <COMPONENT>_BACKEND if set, else INFERENCE_BACKEND."""
+    backend = os.getenv(f"{component.upper()}_BACKEND", INFERENCE_BACKEND)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend for {component}: {backend}")
+    return backend
+
+
+def quantize(model):
+    """Swap every nn.Linear for a dynamically quantized int8 one, in place."""
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def onnx_model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "__"))
+
+
+def _load_onnx(model_name: str, task: str):
+    try:
+        import optimum.onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError("The onnx backend needs `pip install optimum[onnxruntime]`") from e
+
+    cls = getattr(ort, _ORT_CLASSES[task])
+    path = onnx_model_dir(model_name)
+    if os.path.isdir(path):
+        return cls.from_pretrained(path)
+
+    # First use exports the graph; later loads (and other workers) reuse it.
+    # Export beside the cache and rename, so nobody loads a half-written one
+    logging.info(f"Exporting {model_name} to ONNX in {path}")
+    model = cls.from_pretrained(model_name, export=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    model.save_pretrained(tmp_path)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another worker finished its export first; theirs is as good
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return model
+
+
+def load_model(model_name: str, task: str, backend: str):
+    """Load a transformers model for `task` ("feature-extraction" or "text2text-generation") on `backend`."""
+    logging.info(f"Loading {model_name} on the {backend} backend")
+    if backend == "onnx":
+        return _load_onnx(model_name, task)
+
+    import transformers
+
+    model = getattr(transformers, _TORCH_CLASSES[task]).from_pretrained(model_name)
+    model.eval()
+    if backend == "int8":
+        model = quantize(model)
+    return model
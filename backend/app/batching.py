@@ -0,0 +1,147 @@
+# app/batching.py
+
+import os
+import time
+import queue
+import logging
+import threading
+
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional
+
+
+class BatcherBusy(RuntimeError):
+    """The batcher's queue is full, or an item's result took longer than its timeout."""
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item calls into one call of `fn(items)`.
+
+    The first queued item opens a batch; the batch is dispatched once it holds
+    `max_batch_size` items or `max_wait_ms` has passed since that item
+    arrived, whichever comes first. `fn` must return one result per item, in
+    order. Batches run on a dedicated thread, started lazily so forked
+    workers each get their own.
+
+    `max_wait_ms` only bounds how long a batch waits to fill. To bound the
+    latency a caller can be charged, `max_queue` rejects items once that many
+    wait, and `timeout_ms` caps the wait for a result; both raise BatcherBusy
+    so the caller can fall back. An item given up on is dropped unrun if its
+    batch hasn't started. 0 disables either bound.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        name: str,
+        max_queue: int = 0,
+        timeout_ms: float = 0
+    ):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.max_queue = max_queue
+        self.timeout = timeout_ms / 1000.0 if timeout_ms > 0 else None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_batch = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def submit(self, item: Any, timeout_ms: Optional[float] = None) -> Any:
+        """Queue `item` and block until its batch has run, within the batcher's bounds."""
+        self._ensure_thread()
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            with self._stats_lock:
+                self._rejected += 1
+            raise BatcherBusy(f"Batcher {self.name} has {self.max_queue} items queued.")
+
+        timeout = self.timeout if timeout_ms is None else (timeout_ms / 1000.0 if timeout_ms > 0 else None)
+        fut: Future = Future()
+        self._queue.put((item, fut, time.perf_counter()))
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            # Not started yet: the batch thread skips it
+            fut.cancel()
+            with self._stats_lock:
+                self._timed_out += 1
+            raise BatcherBusy(f"Batcher {self.name} gave no result within {timeout:.1f} s.")
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list:
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Drop items whose callers gave up waiting
+            batch = [entry for entry in self._collect() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.fn(items)
+                for (_, fut, _), result in zip(batch, results):
+                    fut.set_result(result)
+            except Exception as e:
+                logging.exception(f"Batcher {self.name} failed on a batch of {len(batch)}: {e}")
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+            self._record(batch, started)
+
+    def _record(self, batch: list, started: float):
+        waits = [started - queued for _, _, queued in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._max_batch = max(self._max_batch, len(batch))
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+
+    def queue_depth(self) -> int:
+        """Items waiting for a batch, not counting the one being processed."""
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 3) if self._batches else 0.0,
+                "max_batch_size": self._max_batch,
+                "avg_wait_ms": round(1000.0 * self._wait_total / self._items, 3) if self._items else 0.0,
+                "max_wait_ms": round(1000.0 * self._wait_max, 3),
+                "queue_depth": self.queue_depth(),
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+            }
@@ -0,0 +1,137 @@
+# app/cache.py
+
+import time
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import metrics
+
+
+def normalize_question(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def hash_key(*parts: Any) -> str:
+    return hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class TwoLevelCache:
+    """
+    In-process LRU in front of Redis. Both levels expire entries after `ttl`
+    seconds; the local level also holds at most `max_items`. Redis errors
+    degrade to local-only caching.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        redis_client,
+        max_items: int,
+        ttl: int,
+        dumps: Callable[[Any], bytes],
+        loads: Callable[[bytes], Any],
+    ):
+        self.namespace = namespace
+        # Metric label: the namespace without its model/version suffix
+        self.label = namespace.split(":")[0]
+        self.redis = redis_client
+        self.max_items = max_items
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _put_local(self, key: str, value: Any):
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_items:
+                self._local.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._local.move_to_end(key)
+                    metrics.inc("cache_lookups_total", cache=self.label, result="local")
+                    return entry[1]
+                del self._local[key]
+
+        blob = None
+        if self.redis is not None:
+            try:
+                blob = self.redis.get(self._redis_key(key))
+            except Exception as e:
+                logging.warning(f"Cache {self.namespace} lookup failed: {e}")
+        if blob is None:
+            metrics.inc("cache_lookups_total", cache=self.label, result="miss")
+            return None
+        metrics.inc("cache_lookups_total", cache=self.label, result="redis")
+        value = self.loads(blob)
+        self._put_local(key, value)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._put_local(key, value)
+        if self.redis is None:
+            return
+        try:
+            self.redis.setex(self._redis_key(key), self.ttl, self.dumps(value))
+        except Exception as e:
+            logging.warning(f"Cache {self.namespace} write failed: {e}")
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Like get() for many keys, with one MGET for the local misses."""
+        found: Dict[str, Any] = {}
+        missing = []
+        for key in keys:
+            with self._lock:
+                entry = self._local.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._local.move_to_end(key)
+                    found[key] = entry[1]
+                    continue
+            missing.append(key)
+
+        if missing and self.redis is not None:
+            try:
+                blobs = self.redis.mget([self._redis_key(k) for k in missing])
+            except Exception as e:
+                logging.warning(f"Cache {self.namespace} lookup failed: {e}")
+                blobs = []
+            for key, blob in zip(missing, blobs):
+                if blob is not None:
+                    found[key] = self.loads(blob)
+                    self._put_local(key, found[key])
+
+        from_redis = len(found) - (len(keys) - len(missing))
+        for result, count in (("local", len(keys) - len(missing)), ("redis", from_redis), ("miss", len(keys) - len(found))):
+            if count:
+                metrics.inc("cache_lookups_total", count, cache=self.label, result=result)
+        return found
+
+    def set_many(self, items: Dict[str, Any]):
+        for key, value in items.items():
+            self._put_local(key, value)
+        if self.redis is None or not items:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.setex(self._redis_key(key), self.ttl, self.dumps(value))
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Cache {self.namespace} write failed: {e}")
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
@@ -0,0 +1,137 @@
+# app/chunker.py
+
+import os
+import re
+
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .embedder import get_tokenizer
+
+# Configuration from environment
+CHUNKER = os.getenv("CHUNKER", "tokens")
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+
+class ChunkPiece(NamedTuple):
+    page_number: int
+    text: str
+    token_count: int
+
+
+def split_sentences(text: str) -> List[str]:
+    # PDF text wraps mid-sentence, so collapse whitespace before splitting
+    flat = " ".join(text.split())
+    return [s for s in _SENTENCE_RE.split(flat) if s]
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    if not texts:
+        return []
+    encoded = get_tokenizer()(texts, add_special_tokens=False)
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+def _content_budget(max_tokens: int) -> int:
+    # Leave room for [CLS]/[SEP] and never exceed what the encoder keeps
+    tokenizer = get_tokenizer()
+    limit = min(max_tokens, tokenizer.model_max_length)
+    return max(1, limit - tokenizer.num_special_tokens_to_add())
+
+
+def _split_long(sentence: str, n_tokens: int, budget: int) -> Iterator[Tuple[str, int]]:
+    if n_tokens <= budget:
+        yield sentence, n_tokens
+        return
+    # Cut on token offsets so pieces keep the original casing and spacing
+    offsets = get_tokenizer()(
+        sentence, add_special_tokens=False, return_offsets_mapping=True
+    )["offset_mapping"]
+    for i in range(0, len(offsets), budget):
+        window = offsets[i : i + budget]
+        yield sentence[window[0][0] : window[-1][1]], len(window)
+
+
+def token_chunker(
+    pages: Iterator[Tuple[int, str]],
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None
+) -> Iterator[ChunkPiece]:
+    """
+    Pack whole sentences into chunks of at most `chunk_size` embedding tokens,
+    carrying up to `overlap` tokens of trailing sentences into the next chunk.
+    Chunks may span page breaks; a chunk reports the page it starts on.
+    """
+    budget = _content_budget(chunk_size or CHUNK_MAX_TOKENS)
+    overlap = CHUNK_OVERLAP_TOKENS if overlap is None else overlap
+
+    window: List[Tuple[int, str, int]] = []
+    size = 0
+
+    def emit() -> ChunkPiece:
+        return ChunkPiece(window[0][0], " ".join(s for _, s, _ in window), size)
+
+    for page_number, page_text in pages:
+        sentences = split_sentences(page_text)
+        for sentence, n in zip(sentences, count_tokens(sentences)):
+            for piece, m in _split_long(sentence, n, budget):
+                if window and size + m > budget:
+                    yield emit()
+                    tail: List[Tuple[int, str, int]] = []
+                    tail_size = 0
+                    for item in reversed(window[1:]):
+                        if tail_size + item[2] > overlap:
+                            break
+                        tail.insert(0, item)
+                        tail_size += item[2]
+                    window, size = tail, tail_size
+                    if size + m > budget:
+                        window, size = [], 0
+                window.append((page_number, piece, m))
+                size += m
+
+    if window:
+        yield emit()
+
+
+def word_chunker(
+    pages: Iterator[Tuple[int, str]],
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None
+) -> Iterator[ChunkPiece]:
+    """Fixed windows of `chunk_size` words per page (the original chunking)."""
+    chunk_size = chunk_size or 500
+    overlap = 50 if overlap is None else overlap
+    for page_number, page_text in pages:
+        words = page_text.split()
+        texts = []
+        start = 0
+        while start < len(words):
+            texts.append(" ".join(words[start : start + chunk_size]))
+            start += chunk_size - overlap
+        for text, n in zip(texts, count_tokens(texts)):
+            yield ChunkPiece(page_number, text, n)
+
+
+CHUNKERS: Dict[str, Callable[..., Iterator[ChunkPiece]]] = {
+    "tokens": token_chunker,
+    "words": word_chunker,
+}
+
+
+def chunk_pages(
+    pages: Iterator[Tuple[int, str]],
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    strategy: Optional[str] = None
+) -> Iterator[ChunkPiece]:
+    """
+    Split a stream of (page_number, text) into chunks with the named strategy
+    (default CHUNKER). `chunk_size`/`overlap` are in the strategy's own unit.
+    """
+    strategy = strategy or CHUNKER
+    if strategy not in CHUNKERS:
+        raise ValueError(f"Unknown chunker: {strategy}")
+    return CHUNKERS[strategy](pages, chunk_size, overlap)
@@ -1,37 +1,66 @@
 # app/embedder.py
 
 import os
-import gzip
+import hashlib
 import logging
 import numpy as np
 import redis
-import torch
 
-from transformers import AutoTokenizer, AutoModel
 from typing import List
 
+from .backends import backend_for, load_model
+from .batching import MicroBatcher
+from .registry import registry
+from .cache import TwoLevelCache, hash_key, normalize_question
+from .metrics import metrics, span
+
 # Configuration from environment
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
 REDIS_TTL = int(os.getenv("REDIS_TTL", 0))
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", 32))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", 5))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", 3600))
 
 redis_client = redis.from_url(REDIS_URL)
 
-_tokenizer = None
-_model = None
+
+# torch/transformers are imported by the loaders, so importing this module is cheap
+def _build_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(EMBED_MODEL)
+
+
+def _build_model():
+    model = load_model(EMBED_MODEL, "feature-extraction", backend_for("embed"))
+    return get_tokenizer(), model
+
+
+registry.register("embed_tokenizer", _build_tokenizer)
+registry.register("embedder", _build_model)
+
 
 def _load_model():
-    global _tokenizer, _model
-    if _tokenizer is None or _model is None:
-        _tokenizer = AutoTokenizer.from_pretrained(EMBED_MODEL)
-        _model = AutoModel.from_pretrained(EMBED_MODEL)
-        _model.eval()
-    return _tokenizer, _model
+    return registry.get("embedder")
+
+
+def get_tokenizer():
+    """The embedding tokenizer alone, without loading model weights."""
+    return registry.get("embed_tokenizer")
 
 
 def _encode_batch(texts: List[str]) -> np.ndarray:
     tokenizer, model = _load_model()
+    with span("encode"):
+        return _encode_with(tokenizer, model, texts)
+
+
+def _encode_with(tokenizer, model, texts: List[str]) -> np.ndarray:
+    """Mean-pooled embeddings of `texts` from any backend's model."""
+    import torch
+
     with torch.no_grad():
         encoded = tokenizer(
             texts,
@@ -50,8 +79,24 @@ def _encode_batch(texts: List[str]) -> np.ndarray:
     return np_emb
 
 
+# Cached vectors are raw float16: half the bytes of float32, where gzip
+# saved almost nothing on float noise. The "f16" in the keys keeps them
+# apart from older gzip entries.
 def _redis_key(chunk_id: str) -> str:
-    return f"embed:{chunk_id}"
+    return f"embed:f16:{chunk_id}"
+
+
+def _content_key(text: str) -> str:
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return f"embed:{EMBED_MODEL}:f16:{digest}"
+
+
+def _pack(emb: np.ndarray) -> bytes:
+    return np.asarray(emb, dtype=np.float16).tobytes()
+
+
+def _unpack(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
 
 
 def get_or_compute_embedding(chunk_id: str, text: str) -> np.ndarray:
@@ -60,12 +105,10 @@ def get_or_compute_embedding(chunk_id: str, text: str) -> np.ndarray:
         cached = redis_client.get(key)
         if cached:
             logging.debug(f"Cache hit for chunk {chunk_id}")
-            decompressed = gzip.decompress(cached)
-            return np.frombuffer(decompressed, dtype=np.float32)
+            return _unpack(cached)
         logging.debug(f"Cache miss for chunk {chunk_id}")
         emb = _encode_batch([text])[0]
-        buf = emb.tobytes()
-        compressed = gzip.compress(buf)
+        compressed = _pack(emb)
 
         if REDIS_TTL > 0:
             redis_client.setex(key, REDIS_TTL, compressed)
@@ -74,10 +117,63 @@ def get_or_compute_embedding(chunk_id: str, text: str) -> np.ndarray:
         return emb
     except Exception as e:
         logging.error(f"Embedding error for chunk {chunk_id}: {e}")
-        dim = _model.config.hidden_size if _model else _encode_batch([text]).shape[1]
+        dim = _load_model()[1].config.hidden_size
         return np.zeros(dim, dtype=np.float32)
 
 
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Embed many texts at once. Cached vectors are fetched with a single MGET
+    keyed by content hash, only the misses are encoded (sorted by length so
+    each batch pads to similar sizes) and written back in one pipeline.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    keys = [_content_key(t) for t in texts]
+    try:
+        cached = redis_client.mget(keys)
+    except Exception as e:
+        logging.error(f"Embedding cache lookup failed: {e}")
+        cached = [None] * len(keys)
+
+    found = {}
+    for key, blob in zip(keys, cached):
+        if blob and key not in found:
+            found[key] = _unpack(blob)
+
+    # Identical texts share a key, so encode each distinct miss once
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in pending:
+            pending[key] = text
+    logging.debug(f"Embedding cache: {len(texts) - len(pending)} hits, {len(pending)} misses")
+    metrics.inc("cache_lookups_total", len(texts) - len(pending), cache="embed", result="hit")
+    metrics.inc("cache_lookups_total", len(pending), cache="embed", result="miss")
+
+    if pending:
+        miss_keys = sorted(pending, key=lambda k: len(pending[k]))
+        computed = {}
+        for i in range(0, len(miss_keys), EMBED_BATCH_SIZE):
+            batch_keys = miss_keys[i : i + EMBED_BATCH_SIZE]
+            batch_embs = _encode_batch([pending[k] for k in batch_keys])
+            for key, emb in zip(batch_keys, batch_embs):
+                computed[key] = emb
+
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.mset({key: _pack(emb) for key, emb in computed.items()})
+            if REDIS_TTL > 0:
+                for key in computed:
+                    pipe.expire(key, REDIS_TTL)
+            pipe.execute()
+        except Exception as e:
+            logging.error(f"Embedding cache write failed: {e}")
+        found.update(computed)
+
+    return np.stack([found[key] for key in keys]).astype(np.float32)
+
+
 def encode_texts_for_chunks(chunks: List[dict]) -> None:
     for i in range(0, len(chunks), EMBED_BATCH_SIZE):
         batch = chunks[i : i + EMBED_BATCH_SIZE]
@@ -93,5 +189,32 @@ def encode_texts_for_chunks(chunks: List[dict]) -> None:
                 chunk['embedding'] = get_or_compute_embedding(chunk['chunk_id'], chunk['text'])
 
 
+# Concurrent /query calls share one forward pass
+query_batcher = MicroBatcher(
+    lambda texts: list(_encode_batch(texts)),
+    max_batch_size=QUERY_BATCH_SIZE,
+    max_wait_ms=QUERY_BATCH_WAIT_MS,
+    name="query-embedding",
+)
+
+
+# Repeated questions skip the model entirely
+query_cache = TwoLevelCache(
+    f"qembed:{EMBED_MODEL}",
+    redis_client,
+    max_items=QUERY_CACHE_SIZE,
+    ttl=QUERY_CACHE_TTL,
+    dumps=lambda emb: emb.astype(np.float32).tobytes(),
+    loads=lambda blob: np.frombuffer(blob, dtype=np.float32),
+)
+
+
 def get_query_embedding(text: str) -> np.ndarray:
-    return _encode_batch([text]).astype(np.float32)
+    # Normalized for the key only: a cased model embeds "Paris" and "paris" differently
+    key = hash_key(normalize_question(text))
+    emb = query_cache.get(key)
+    if emb is None:
+        with span("embed_query"):
+            emb = query_batcher.submit(text)
+        query_cache.set(key, emb)
+    return emb[None, :].astype(np.float32)
@@ -0,0 +1,87 @@
+# app/fusion.py
+
+import os
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Configuration from environment
+FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf")
+FUSION_RRF_K = int(os.getenv("FUSION_RRF_K", "60"))
+FUSION_WEIGHTS = {
+    "bm25": float(os.getenv("FUSION_WEIGHT_BM25", "1.0")),
+    "vector": float(os.getenv("FUSION_WEIGHT_VECTOR", "1.0")),
+}
+
+Hits = List[Tuple[int, float]]
+
+
+def _weight(weights: Dict[str, float], source: str) -> float:
+    return weights.get(source, 1.0)
+
+
+def rrf(sources: Dict[str, Hits], weights: Dict[str, float]) -> Dict[int, float]:
+    """Reciprocal Rank Fusion: sum of w / (k + rank); raw scores are ignored."""
+    fused: Dict[int, float] = {}
+    for source, hits in sources.items():
+        w = _weight(weights, source)
+        ranked = sorted(hits, key=lambda h: h[1], reverse=True)
+        for rank, (cid, _) in enumerate(ranked, start=1):
+            fused[cid] = fused.get(cid, 0.0) + w / (FUSION_RRF_K + rank)
+    return fused
+
+
+def minmax(sources: Dict[str, Hits], weights: Dict[str, float]) -> Dict[int, float]:
+    """Weighted sum of scores rescaled to [0, 1] within each source."""
+    fused: Dict[int, float] = {}
+    for source, hits in sources.items():
+        if not hits:
+            continue
+        w = _weight(weights, source)
+        scores = [s for _, s in hits]
+        lo, hi = min(scores), max(scores)
+        span = hi - lo
+        for cid, s in hits:
+            norm = (s - lo) / span if span > 0 else 1.0
+            fused[cid] = fused.get(cid, 0.0) + w * norm
+    return fused
+
+
+def zscore(sources: Dict[str, Hits], weights: Dict[str, float]) -> Dict[int, float]:
+    """Weighted sum of per-source z-scores; a source missing a hit adds nothing."""
+    fused: Dict[int, float] = {}
+    for source, hits in sources.items():
+        if not hits:
+            continue
+        w = _weight(weights, source)
+        scores = [s for _, s in hits]
+        mean = sum(scores) / len(scores)
+        std = (sum((s - mean) ** 2 for s in scores) / len(scores)) ** 0.5
+        for cid, s in hits:
+            norm = (s - mean) / std if std > 0 else 0.0
+            fused[cid] = fused.get(cid, 0.0) + w * norm
+    return fused
+
+
+FUSERS: Dict[str, Callable[[Dict[str, Hits], Dict[str, float]], Dict[int, float]]] = {
+    "rrf": rrf,
+    "minmax": minmax,
+    "zscore": zscore,
+}
+
+
+def fuse(
+    sources: Dict[str, Hits],
+    method: Optional[str] = None,
+    weights: Optional[Dict[str, float]] = None
+) -> Hits:
+    """
+    Merge per-source hit lists ({"bm25": [...], "vector": [...]}) into one
+    ranking, best first. `weights` overrides FUSION_WEIGHT_* per source.
+    """
+    method = method or FUSION_METHOD
+    if method not in FUSERS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    merged = dict(FUSION_WEIGHTS)
+    merged.update(weights or {})
+    fused = FUSERS[method](sources, merged)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
@@ -3,10 +3,16 @@
 import os
 import re
 import logging
-import torch
+import threading
 
-from typing import List, Tuple
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from typing import Iterator, List, Optional, Tuple
+
+from .backends import backend_for, load_model
+from .batching import BatcherBusy, MicroBatcher
+from .registry import registry
+from .metrics import metrics, span
+from .packer import PackedPrompt, pack_context, pad_batch
+from . import sentence_index
 
 # Configuration from environment
 GENERATION_MODEL = os.getenv("GENERATION_MODEL", "sshleifer/distilbart-cnn-6-6")
@@ -15,25 +21,45 @@ TORCH_THREADS = int(os.getenv("TORCH_NUM_THREADS", "1"))
 
 MAX_CHUNKS = int(os.getenv("MAX_CHUNKS", "4"))
 MAX_CHARS_PER_CHUNK = int(os.getenv("MAX_CHARS_PER_CHUNK", "350"))
+# "tokens" packs ranked sentences to PROMPT_TOKEN_BUDGET (app.packer); "chars"
+# is the original per-chunk character slice
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "tokens").lower()
 
 MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "128"))
 NUM_BEAMS = int(os.getenv("NUM_BEAMS", "2"))
+STREAM_TIMEOUT = float(os.getenv("STREAM_TIMEOUT", "30"))
+
+GEN_BATCH_SIZE = int(os.getenv("GEN_BATCH_SIZE", "4"))
+GEN_MAX_WAIT_MS = float(os.getenv("GEN_MAX_WAIT_MS", "25"))
+# Bounds on the latency the generator queue can add; past them the answer is extractive
+GEN_MAX_QUEUE = int(os.getenv("GEN_MAX_QUEUE", "32"))
+GEN_TIMEOUT_MS = float(os.getenv("GEN_TIMEOUT_MS", "15000"))
+# Answer extractively once this many prompts wait for the generator; 0 never sheds
+GEN_SHED_QUEUE = int(os.getenv("GEN_SHED_QUEUE", "0"))
+
+ANSWER_MODES = ("generative", "extractive")
+
+NOT_FOUND = "I couldn't find that in the uploaded document."
+
+
+def _build_model():
+    import torch
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(GENERATION_MODEL)
+    model = load_model(GENERATION_MODEL, "text2text-generation", backend_for("gen"))
+    try:
+        torch.set_num_threads(TORCH_THREADS)
+    except Exception:
+        pass
+    return tokenizer, model
+
 
-_tokenizer = None
-_model = None
+registry.register("generator", _build_model)
 
 
 def _load_model():
-    global _tokenizer, _model
-    if _tokenizer is None or _model is None:
-        _tokenizer = AutoTokenizer.from_pretrained(GENERATION_MODEL)
-        _model = AutoModelForSeq2SeqLM.from_pretrained(GENERATION_MODEL)
-        _model.eval()
-        try:
-            torch.set_num_threads(TORCH_THREADS)
-        except Exception:
-            pass
-    return _tokenizer, _model
+    return registry.get("generator")
 
 
 def _sentence_split(text: str) -> List[str]:
@@ -42,6 +68,25 @@ def _sentence_split(text: str) -> List[str]:
 
 
 def _extractive_fallback(question: str, chunks: List) -> str:
+    """
+    Best sentences of the top chunks, scored over the document's precomputed
+    sentence index; the regex scorer covers documents without one.
+    """
+    with span("extractive"):
+        try:
+            best = sentence_index.best_sentences(question, chunks[:MAX_CHUNKS])
+        except Exception as e:
+            logging.exception(f"Sentence index scoring failed: {e}")
+            best = None
+        if best is None:
+            return _regex_extractive(question, chunks)
+        if best:
+            return " ".join(best)
+        sents = _sentence_split((chunks[0].text or "")[:800]) if chunks else []
+        return " ".join(sents[:3]) or NOT_FOUND
+
+
+def _regex_extractive(question: str, chunks: List) -> str:
     q_tokens = set(re.findall(r"\w+", (question or "").lower()))
     scored = []
     for c in chunks[:MAX_CHUNKS]:
@@ -53,8 +98,8 @@ def _extractive_fallback(question: str, chunks: List) -> str:
     if not scored:
         if chunks:
             sents = _sentence_split((chunks[0].text or "")[:800])
-            return " ".join(sents[:3]) or "I couldn't find that in the uploaded document."
-        return "I couldn't find that in the uploaded document."
+            return " ".join(sents[:3]) or NOT_FOUND
+        return NOT_FOUND
     scored.sort(key=lambda x: x[0], reverse=True)
     best = [s for _, s in scored[:5]]
     return " ".join(best)
@@ -77,26 +122,78 @@ def _build_prompt(question: str, chunks: List) -> str:
     )
 
 
-@torch.inference_mode()
-def generate_answer(question: str, chunks: List) -> Tuple[str, List[int]]:
-    if not chunks:
-        return "I couldn't find that in the uploaded document.", []
+def cited_ids(chunks: List) -> List[int]:
+    return [int(c.id) for c in chunks[:MAX_CHUNKS]]
 
-    if not USE_GENERATOR:
-        ans = _extractive_fallback(question, chunks)
-        return ans, [int(c.id) for c in chunks[:MAX_CHUNKS]]
 
+def pack_prompt(question: str, chunks: List) -> Optional[PackedPrompt]:
+    """
+    The token-packed prompt for `chunks`, whose chunk_ids are what a
+    generated answer cites; None without CONTEXT_PACKING=tokens or when
+    packing fails. Pass it on to stream_answer() so it isn't packed twice.
+    """
+    if CONTEXT_PACKING != "tokens" or not chunks:
+        return None
     try:
-        tokenizer, model = _load_model()
-        prompt = _build_prompt(question, chunks)
+        tokenizer, _ = _load_model()
+        return _pack(tokenizer, question, chunks)
+    except Exception as e:
+        logging.warning(f"Context packing failed: {e}")
+        return None
+
+
+def _pack(tokenizer, question: str, chunks: List):
+    with span("pack_context"):
+        return pack_context(tokenizer, question, chunks[:MAX_CHUNKS])
+
+
+def _encode_prompt(tokenizer, question: str, chunks: List, packed: Optional[PackedPrompt] = None):
+    if packed is not None:
+        return pad_batch(tokenizer, [packed.input_ids])
+    if CONTEXT_PACKING == "tokens":
+        return pad_batch(tokenizer, [_pack(tokenizer, question, chunks).input_ids])
+    return tokenizer(
+        _build_prompt(question, chunks),
+        return_tensors="pt",
+        truncation=True,
+        max_length=1024
+    )
+
+
+def _clean_answer(answer: str) -> str:
+    answer = answer.strip()
+    if answer.lower().startswith("summary:"):
+        answer = answer[8:].strip()
+
+    sentences = _sentence_split(answer)
+    if sentences:
+        answer = " ".join(sentences).strip()
+    return answer
+
+
+def _generate_batch(prompts: List) -> List[str]:
+    """Pad `prompts` into one batch and beam-search them in a single generate call."""
+    tokenizer, model = _load_model()
+    with span("generate_batch"):
+        return _generate_with(tokenizer, model, prompts)
+
 
+def _generate_with(tokenizer, model, prompts: List) -> List[str]:
+    """`prompts` are prompt strings or already packed token id lists."""
+    import torch
+
+    if prompts and not isinstance(prompts[0], str):
+        inputs = pad_batch(tokenizer, prompts)
+    else:
         inputs = tokenizer(
-            prompt,
+            prompts,
             return_tensors="pt",
+            padding=True,
             truncation=True,
             max_length=1024
         )
 
+    with torch.inference_mode():
         output_ids = model.generate(
             **inputs,
             max_new_tokens=MAX_NEW_TOKENS,
@@ -107,17 +204,170 @@ def generate_answer(question: str, chunks: List) -> Tuple[str, List[int]]:
             length_penalty=2.0,
         )
 
-        answer = tokenizer.decode(output_ids[0], skip_special_tokens=True).strip()
-        if answer.lower().startswith("summary:"):
-            answer = answer[8:].strip()
+    return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+
+# Prompts from concurrent requests share one generate call on the batcher's
+# thread; GEN_MAX_WAIT_MS caps how long a prompt waits for company, and
+# GEN_MAX_QUEUE/GEN_TIMEOUT_MS how long it can wait in all.
+generation_batcher = MicroBatcher(
+    _generate_batch,
+    max_batch_size=GEN_BATCH_SIZE,
+    max_wait_ms=GEN_MAX_WAIT_MS,
+    name="generate",
+    max_queue=GEN_MAX_QUEUE,
+    timeout_ms=GEN_TIMEOUT_MS,
+)
+
+
+def answer_mode(requested: Optional[str] = None, shed: bool = True) -> str:
+    """
+    "extractive" when asked for, when the generator is disabled, or (with
+    `shed`) when GEN_SHED_QUEUE prompts already wait for it; otherwise
+    "generative".
+    """
+    if requested == "extractive" or not USE_GENERATOR:
+        return "extractive"
+    if shed and GEN_SHED_QUEUE and generation_batcher.queue_depth() >= GEN_SHED_QUEUE:
+        return "extractive"
+    return "generative"
+
+
+def generate_answer(
+    question: str,
+    chunks: List,
+    mode: Optional[str] = None,
+    details: Optional[dict] = None
+) -> Tuple[str, List[int]]:
+    """
+    Answer from `chunks`. An explicit `mode` is used as given; without one,
+    answer_mode() decides, shedding included. Pass a `details` dict to learn
+    the `mode` actually used: "extractive" too when generation failed.
+    """
+    if details is None:
+        details = {}
+    if not chunks:
+        details["mode"] = answer_mode(mode, shed=False)
+        return NOT_FOUND, []
 
-        sentences = _sentence_split(answer)
-        if sentences:
-            answer = " ".join(sentences).strip()
+    mode = details["mode"] = answer_mode(mode, shed=mode is None)
+    metrics.inc("answers_total", mode=mode)
+    if mode == "extractive":
+        ans = _extractive_fallback(question, chunks)
+        return ans, cited_ids(chunks)
 
+    citations = cited_ids(chunks)
+    try:
+        if CONTEXT_PACKING == "tokens":
+            tokenizer, _ = _load_model()
+            packed = _pack(tokenizer, question, chunks)
+            prompt, citations = packed.input_ids, packed.chunk_ids
+        else:
+            prompt = _build_prompt(question, chunks)
+        answer = _clean_answer(generation_batcher.submit(prompt))
+    except BatcherBusy as e:
+        logging.warning(f"{e} Answering extractively.")
+        answer, citations = _extractive_fallback(question, chunks), cited_ids(chunks)
+        details["mode"] = "extractive"
     except Exception as e:
         logging.exception(f"DistilBART generation failed, using extractive fallback: {e}")
-        answer = _extractive_fallback(question, chunks)
+        answer, citations = _extractive_fallback(question, chunks), cited_ids(chunks)
+        details["mode"] = "extractive"
+
+    return answer, citations
+
+
+def stream_answer(
+    question: str,
+    chunks: List,
+    mode: Optional[str] = None,
+    details: Optional[dict] = None,
+    packed: Optional[PackedPrompt] = None
+) -> Iterator[str]:
+    """
+    Yield the answer in text pieces as greedy decoding produces them. Beam
+    search can't stream, so this trades NUM_BEAMS for time-to-first-token.
+    Closing the iterator stops the decode at the next step. Falls back to the
+    extractive answer, as a single piece, if the model fails before emitting.
+    `mode` and `details` work as in generate_answer(); `packed` is the
+    pack_prompt() result, if the caller already packed the context.
+    """
+    if details is None:
+        details = {}
+    if not chunks:
+        details["mode"] = answer_mode(mode, shed=False)
+        yield NOT_FOUND
+        return
+
+    mode = details["mode"] = answer_mode(mode, shed=mode is None)
+    metrics.inc("answers_total", mode=mode)
+    if mode == "extractive":
+        yield _extractive_fallback(question, chunks)
+        return
+
+    stop = threading.Event()
+    failure = []
+    try:
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        class _StopOnEvent(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return stop.is_set()
+
+        tokenizer, model = _load_model()
+        inputs = _encode_prompt(tokenizer, question, chunks, packed)
+        streamer = TextIteratorStreamer(
+            tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TIMEOUT
+        )
+
+        def _run():
+            try:
+                with torch.inference_mode():
+                    model.generate(
+                        **inputs,
+                        streamer=streamer,
+                        max_new_tokens=MAX_NEW_TOKENS,
+                        num_beams=1,
+                        do_sample=False,
+                        no_repeat_ngram_size=3,
+                        stopping_criteria=StoppingCriteriaList([_StopOnEvent()]),
+                    )
+            except Exception as e:
+                failure.append(e)
+                streamer.end()
+
+        threading.Thread(target=_run, name="generate-stream", daemon=True).start()
+    except Exception as e:
+        logging.exception(f"DistilBART streaming failed to start, using extractive fallback: {e}")
+        details["mode"] = "extractive"
+        yield _extractive_fallback(question, chunks)
+        return
+
+    emitted = False
+    head = ""
+    try:
+        for piece in streamer:
+            if not emitted:
+                # Hold back the start until a "Summary:" echo can be stripped
+                head += piece
+                if len(head) < 8 and "summary:".startswith(head.strip().lower()):
+                    continue
+                piece = re.sub(r"^\s*summary:\s*", "", head, flags=re.IGNORECASE).lstrip()
+                if not piece:
+                    continue
+            emitted = True
+            yield piece
+        if not emitted and head.strip() and not failure:
+            emitted = True
+            yield head.strip()
+    except Exception as e:
+        failure.append(e)
+    finally:
+        stop.set()
 
-    cited = [int(c.id) for c in chunks[:MAX_CHUNKS]]
-    return answer, cited
+    if failure:
+        logging.error(f"DistilBART streaming failed: {failure[0]}")
+    if not emitted:
+        details["mode"] = "extractive"
+        yield _extractive_fallback(question, chunks)
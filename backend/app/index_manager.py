@@ -0,0 +1,312 @@
+# app/index_manager.py
+
+import os
+import json
+import time
+import logging
+import threading
+import faiss
+import numpy as np
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+from whoosh import index as whoosh_index
+
+from .metrics import metrics
+
+# Configuration from environment
+WHOOSH_INDEX_DIR = os.getenv("WHOOSH_INDEX_DIR", "indexes/whoosh_index")
+FAISS_INDEX_DIR  = os.getenv("FAISS_INDEX_DIR",  "indexes/faiss_index")
+INDEX_MANIFEST = os.getenv(
+    "INDEX_MANIFEST",
+    os.path.join(os.path.dirname(FAISS_INDEX_DIR.rstrip("/")) or ".", "manifest.json"),
+)
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "1.0"))
+DOC_INDEX_CACHE_SIZE = int(os.getenv("DOC_INDEX_CACHE_SIZE", "64"))
+
+
+# Manifest: the single file writers bump after persisting a new generation
+def read_manifest() -> dict:
+    manifest = {
+        "generation": 0,
+        "whoosh_dir": WHOOSH_INDEX_DIR,
+        "faiss_dir": FAISS_INDEX_DIR,
+    }
+    try:
+        with open(INDEX_MANIFEST, "r", encoding="utf-8") as f:
+            manifest.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.exception(f"Failed to read index manifest {INDEX_MANIFEST}: {e}")
+    return manifest
+
+
+def publish(**changes) -> int:
+    """
+    Record a new index generation. Call after the index files are fully
+    written; readers only reload once the manifest changes.
+    """
+    manifest = read_manifest()
+    manifest.update(changes)
+    manifest["generation"] = int(manifest["generation"]) + 1
+    manifest["published_at"] = time.time()
+
+    folder = os.path.dirname(INDEX_MANIFEST)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{INDEX_MANIFEST}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, INDEX_MANIFEST)
+
+    logging.info(f"Published index generation {manifest['generation']}.")
+    return manifest["generation"]
+
+
+def _file_stamp(path: str) -> Optional[tuple]:
+    """Identity of a file's contents: writers replace files or append, never rewrite in place."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class IndexSnapshot:
+    """Immutable view of one index generation; queries hold on to it until done."""
+
+    def __init__(
+        self,
+        generation: int,
+        ix,
+        faiss_index,
+        row_ids: Optional[np.ndarray],
+        faiss_dir: str,
+        tombstones: frozenset = frozenset(),
+        faiss_deltas: tuple = (),
+        stamps: Optional[dict] = None
+    ):
+        self.generation = generation
+        self.ix = ix
+        self.faiss_index = faiss_index
+        # Only for legacy positional indexes: row number -> chunk id
+        self.row_ids = row_ids
+        self.faiss_dir = faiss_dir
+        # Flat indexes of vectors appended since the global index was written
+        self.faiss_deltas = faiss_deltas
+        # Chunk ids of deleted documents still present in the global index
+        self.tombstones = tombstones
+        # File stamps of what was loaded, so the next generation can reuse it
+        self.stamps = stamps or {}
+        self._doc_indexes: "OrderedDict[int, Tuple[Optional[tuple], Optional[faiss.Index]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def doc_index(self, doc_id: int) -> Optional[faiss.Index]:
+        """Per-document FAISS partition, loaded on first use and kept in a small LRU."""
+        with self._lock:
+            if doc_id in self._doc_indexes:
+                self._doc_indexes.move_to_end(doc_id)
+                return self._doc_indexes[doc_id][1]
+
+        index = None
+        path = os.path.join(self.faiss_dir, "docs", f"{doc_id}.index")
+        stamp = _file_stamp(path)
+        if stamp is not None:
+            try:
+                index = faiss.read_index(path)
+            except Exception as e:
+                logging.exception(f"Failed to load FAISS partition {path}: {e}")
+        else:
+            logging.warning(f"No FAISS partition for document {doc_id}; run a full reindex.")
+
+        with self._lock:
+            self._doc_indexes[doc_id] = (stamp, index)
+            while len(self._doc_indexes) > DOC_INDEX_CACHE_SIZE:
+                self._doc_indexes.popitem(last=False)
+        return index
+
+    def _inherit_doc_indexes(self, previous: "IndexSnapshot"):
+        """Keep the partitions of `previous` whose files haven't changed since."""
+        if previous.faiss_dir != self.faiss_dir:
+            return
+        with previous._lock:
+            cached = list(previous._doc_indexes.items())
+        for doc_id, (stamp, index) in cached:
+            path = os.path.join(self.faiss_dir, "docs", f"{doc_id}.index")
+            if index is not None and stamp == _file_stamp(path):
+                self._doc_indexes[doc_id] = (stamp, index)
+
+
+def _load_snapshot(manifest: dict, previous: Optional[IndexSnapshot] = None) -> IndexSnapshot:
+    """
+    Load the generation `manifest` names. Files unchanged since `previous`
+    (same directory and stamp) are reused rather than read again, so a
+    generation published by an upload costs its new delta files, not the
+    whole global index.
+    """
+    whoosh_dir = manifest["whoosh_dir"]
+    faiss_dir = manifest["faiss_dir"]
+    if previous is not None and previous.faiss_dir != faiss_dir:
+        previous = None
+    reuse = previous.stamps if previous is not None else {}
+    stamps = {}
+
+    ix = None
+    if whoosh_index.exists_in(whoosh_dir):
+        try:
+            ix = whoosh_index.open_dir(whoosh_dir)
+            logging.info(f"Loaded Whoosh index from {whoosh_dir}")
+        except Exception as e:
+            logging.exception(f"Failed to open Whoosh index at {whoosh_dir}: {e}")
+    else:
+        logging.warning(f"Whoosh index not found in {whoosh_dir}")
+
+    faiss_index = None
+    row_ids: Optional[np.ndarray] = None
+    try:
+        idx_file = os.path.join(faiss_dir, "faiss.index")
+        id_map_file = os.path.join(faiss_dir, "id_map.json")
+        stamp = _file_stamp(idx_file)
+        if stamp is not None and stamp == reuse.get("faiss.index") and previous.faiss_index is not None:
+            faiss_index, row_ids = previous.faiss_index, previous.row_ids
+            stamps["faiss.index"] = stamp
+        elif stamp is not None:
+            faiss_index = faiss.read_index(idx_file)
+            stamps["faiss.index"] = stamp
+            logging.info(f"Loaded FAISS index from {idx_file}")
+        else:
+            logging.warning(f"FAISS index file not found at {idx_file}")
+        # IndexIDMap2 returns chunk ids itself; older indexes ship an id_map.json
+        # until the next write migrates them
+        if row_ids is None and os.path.exists(id_map_file) and not isinstance(faiss_index, faiss.IndexIDMap2):
+            with open(id_map_file, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+            row_ids = np.full(len(legacy), -1, dtype=np.int64)
+            for row, cid in legacy.items():
+                row_ids[int(row)] = int(cid)
+            logging.info(f"Loaded legacy FAISS id_map from {id_map_file}")
+    except Exception as e:
+        logging.exception(f"Failed to load FAISS index: {e}")
+        faiss_index = None
+        row_ids = None
+
+    deltas = []
+    deltas_dir = os.path.join(faiss_dir, "deltas")
+    if faiss_index is not None and os.path.isdir(deltas_dir):
+        # Deltas only pair with the base they were appended to
+        known = {}
+        if stamps.get("faiss.index") == reuse.get("faiss.index"):
+            known = dict(reuse.get("deltas", ()))
+        fresh = 0
+        loaded = []
+        for name in sorted(os.listdir(deltas_dir)):
+            if not name.endswith(".index"):
+                continue
+            path = os.path.join(deltas_dir, name)
+            stamp = _file_stamp(path)
+            if stamp is not None and name in known and known[name][0] == stamp:
+                loaded.append((name, known[name]))
+                continue
+            try:
+                loaded.append((name, (stamp, faiss.read_index(path))))
+                fresh += 1
+            except Exception as e:
+                # Merged into the base and deleted while we listed them
+                logging.warning(f"Skipping FAISS delta {name}: {e}")
+        deltas = [index for _, (_, index) in loaded]
+        stamps["deltas"] = tuple(loaded)
+        if fresh:
+            logging.info(f"Loaded {fresh} new FAISS delta files from {deltas_dir} ({len(deltas)} in use)")
+
+    tombstones = frozenset()
+    tomb_file = os.path.join(faiss_dir, "tombstones.i64")
+    stamp = _file_stamp(tomb_file)
+    if stamp is not None:
+        old = reuse.get("tombstones")
+        if old is not None and old[0] == stamp[0] and old[2] <= stamp[2]:
+            # Same file, only appended to since: read the new tail
+            tail = np.fromfile(tomb_file, dtype=np.int64, offset=old[2])
+            tombstones = previous.tombstones | frozenset(int(cid) for cid in tail)
+        else:
+            tombstones = frozenset(int(cid) for cid in np.fromfile(tomb_file, dtype=np.int64))
+        stamps["tombstones"] = stamp
+
+    snapshot = IndexSnapshot(
+        int(manifest["generation"]), ix, faiss_index, row_ids, faiss_dir, tombstones, tuple(deltas), stamps
+    )
+    if previous is not None:
+        snapshot._inherit_doc_indexes(previous)
+    return snapshot
+
+
+class IndexManager:
+    """
+    Serves the latest published index generation. The manifest mtime is
+    checked at most every INDEX_RELOAD_INTERVAL seconds; when it changes the
+    new generation is loaded off to the side and swapped in with a single
+    assignment, so in-flight queries finish on the snapshot they started with.
+    """
+
+    def __init__(self, reload_interval: float = INDEX_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._manifest_mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _manifest_stamp(self):
+        try:
+            return os.stat(INDEX_MANIFEST).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def current(self) -> IndexSnapshot:
+        now = time.monotonic()
+        if self._snapshot is not None and now < self._next_check:
+            return self._snapshot
+
+        with self._lock:
+            if self._snapshot is None or now >= self._next_check:
+                self._next_check = now + self.reload_interval
+                self.reload(self._manifest_stamp())
+        return self._snapshot
+
+    def reload(self, stamp=None):
+        old = self._snapshot
+        # Without a manifest, keep polling until both indexes exist so a cold
+        # deploy picks up the first build without a restart
+        incomplete = old is not None and (old.ix is None or old.faiss_index is None)
+        cold = stamp is None and incomplete
+        if old is not None and stamp == self._manifest_mtime and not cold:
+            return
+
+        manifest = read_manifest()
+        if old is None or int(manifest["generation"]) != old.generation or cold:
+            self._snapshot = _load_snapshot(manifest, old)
+            if old is not None and self._snapshot.generation != old.generation:
+                logging.info(
+                    f"Swapped index generation {old.generation} -> {self._snapshot.generation}."
+                )
+        self._manifest_mtime = stamp
+
+    @property
+    def generation(self) -> int:
+        return self.current().generation
+
+
+index_manager = IndexManager()
+
+
+@metrics.collector
+def _index_gauges(m):
+    # Only what this process already serves; never loads indexes for a scrape
+    snapshot = index_manager._snapshot
+    if snapshot is None:
+        return
+    m.set("index_generation", snapshot.generation)
+    m.set("index_tombstones", len(snapshot.tombstones))
+    if snapshot.faiss_index is not None:
+        m.set("index_vectors", snapshot.faiss_index.ntotal + sum(d.ntotal for d in snapshot.faiss_deltas))
+    if snapshot.ix is not None:
+        m.set("index_documents", snapshot.ix.doc_count())
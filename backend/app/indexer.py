@@ -1,8 +1,10 @@
 # app/indexer.py
 import os
 import json
+import time
+import shutil
 import logging
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 import faiss
@@ -11,18 +13,47 @@ from whoosh.fields import Schema, TEXT, ID, NUMERIC
 from whoosh.writing import AsyncWriter
 
 from .models import Chunk
+from .index_manager import publish, read_manifest
+from .vector_store import VectorStore, vector_store
+from .metrics import span
 from . import db
 
 # Configuration from environment
 WHOOSH_INDEX_DIR = os.getenv("WHOOSH_INDEX_DIR", "indexes/whoosh_index")
 FAISS_INDEX_DIR  = os.getenv("FAISS_INDEX_DIR",  "indexes/faiss_index")
 
+# Global FAISS index layout: flat | hnsw | ivfpq
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_MIN_ANN_SIZE = int(os.getenv("FAISS_MIN_ANN_SIZE", "10000"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "16"))
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+FAISS_TRAIN_SAMPLE = int(os.getenv("FAISS_TRAIN_SAMPLE", "50000"))
+
+# Full rebuilds stream rows in batches of this size
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "1000"))
+WHOOSH_WRITER_LIMITMB = int(os.getenv("WHOOSH_WRITER_LIMITMB", "256"))
+
+# Appends write delta files; fold them into the global index beyond this many
+FAISS_MAX_DELTAS = int(os.getenv("FAISS_MAX_DELTAS", "32"))
+
+# Compact the global index once this share of its vectors belongs to deleted chunks
+COMPACT_TOMBSTONE_RATIO = float(os.getenv("COMPACT_TOMBSTONE_RATIO", "0.2"))
+
 
 def _ensure_dir(path: str):
     if not os.path.exists(path):
         os.makedirs(path)
 
 
+def _active_dirs() -> Tuple[str, str]:
+    """Whoosh and FAISS directories of the published generation."""
+    manifest = read_manifest()
+    return manifest["whoosh_dir"], manifest["faiss_dir"]
+
+
 # Whoosh (BM25) Indexing
 def _create_whoosh_schema() -> Schema:
     return Schema(
@@ -34,17 +65,22 @@ def _create_whoosh_schema() -> Schema:
     )
 
 
-def build_whoosh_index(chunks: List[Chunk]):
-    _ensure_dir(WHOOSH_INDEX_DIR)
-    if whoosh_index.exists_in(WHOOSH_INDEX_DIR):
-        idx = whoosh_index.open_dir(WHOOSH_INDEX_DIR)
-    else:
-        schema = _create_whoosh_schema()
-        idx = whoosh_index.create_in(WHOOSH_INDEX_DIR, schema)
+def _open_whoosh_index(whoosh_dir: str):
+    _ensure_dir(whoosh_dir)
+    if whoosh_index.exists_in(whoosh_dir):
+        return whoosh_index.open_dir(whoosh_dir)
+    schema = _create_whoosh_schema()
+    return whoosh_index.create_in(whoosh_dir, schema)
+
 
+def build_whoosh_index(chunks: List[Chunk], append: bool = False, whoosh_dir: Optional[str] = None):
+    idx = _open_whoosh_index(whoosh_dir or _active_dirs()[0])
+
+    # Appending skips the unique-key lookup update_document does per chunk
     writer = AsyncWriter(idx)
+    write = writer.add_document if append else writer.update_document
     for chunk in chunks:
-        writer.update_document(
+        write(
             chunk_id=str(chunk.id),
             document_id=chunk.document_id,
             page_number=chunk.page_number,
@@ -55,99 +91,598 @@ def build_whoosh_index(chunks: List[Chunk]):
     logging.info(f"Whoosh index updated with {len(chunks)} chunks.")
 
 
-def rebuild_whoosh_index():
-    logging.info("Rebuilding Whoosh index from DB...")
-    chunks = db.session.query(Chunk).all()
+# FAISS (vector) Indexing
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+    return embeddings / norms
+
+
+def create_faiss_index(
+    embeddings: np.ndarray,
+    index_type: Optional[str] = None,
+    total: Optional[int] = None
+) -> faiss.Index:
+    """
+    Build an empty index of the configured type and train it on a sample of
+    `embeddings` when the type needs training. Corpora smaller than
+    FAISS_MIN_ANN_SIZE always get an exact IndexFlatIP. Pass `total` when
+    `embeddings` is only a sample of the corpus.
+    """
+    index_type = (index_type or FAISS_INDEX_TYPE).lower()
+    n, dim = embeddings.shape
+    n = total or n
+    if index_type != "flat" and n < FAISS_MIN_ANN_SIZE:
+        logging.info(f"Only {n} vectors; using flat index instead of {index_type}.")
+        index_type = "flat"
+
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dim)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+        return index
+
+    if index_type == "ivfpq":
+        nlist = FAISS_IVF_NLIST or max(1, int(4 * np.sqrt(n)))
+        index = faiss.index_factory(
+            dim, f"IVF{nlist},PQ{FAISS_PQ_M}x{FAISS_PQ_NBITS}", faiss.METRIC_INNER_PRODUCT
+        )
+        sample = embeddings
+        if len(sample) > FAISS_TRAIN_SAMPLE:
+            rows = np.random.default_rng(0).choice(len(sample), FAISS_TRAIN_SAMPLE, replace=False)
+            sample = embeddings[np.sort(rows)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        logging.info(f"Trained IVF{nlist},PQ{FAISS_PQ_M} on {len(sample)} vectors.")
+        return index
 
-    if os.path.exists(WHOOSH_INDEX_DIR):
-        for fname in os.listdir(WHOOSH_INDEX_DIR):
-            path = os.path.join(WHOOSH_INDEX_DIR, fname)
-            os.remove(path)
-    build_whoosh_index(chunks)
+    raise ValueError(f"Unknown FAISS_INDEX_TYPE: {index_type}")
 
 
-# FAISS (vector) Indexing
-def build_faiss_index(chunks: List[Chunk]) -> Tuple[faiss.Index, List[int]]:
-    valid = [(chunk.id, chunk.embedding) for chunk in chunks if chunk.embedding]
+def _chunk_vectors(chunks: List[Chunk]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(chunk ids, document ids, embeddings) of the chunks that have an embedding."""
+    valid = [c for c in chunks if c.embedding]
     if not valid:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros((0, 0), np.float32)
+    ids = np.array([c.id for c in valid], dtype=np.int64)
+    docs = np.array([c.document_id for c in valid], dtype=np.int64)
+    embs = np.stack([np.frombuffer(c.embedding, dtype=np.float32) for c in valid])
+    return ids, docs, embs
+
+
+def _with_ids(index: faiss.Index) -> faiss.IndexIDMap2:
+    """Wrap an empty index so vectors are added and returned by chunk id."""
+    return faiss.IndexIDMap2(index)
+
+
+def build_faiss_index(
+    store: Optional[VectorStore] = None,
+    keep: Optional[np.ndarray] = None
+) -> faiss.IndexIDMap2:
+    """
+    Build the global index from the vector store, one batch of rows at a
+    time. `keep` limits it to those chunk ids.
+    """
+    store = store or vector_store
+    if not len(store):
         raise ValueError("No embeddings found for FAISS indexing.")
 
-    ids, emb_blobs = zip(*valid)
-    embeddings = np.stack([np.frombuffer(blob, dtype=np.float32) for blob in emb_blobs])
+    index = _with_ids(create_faiss_index(store.sample(FAISS_TRAIN_SAMPLE), total=len(store)))
+    for batch_ids, _, embs in store.iter_batches():
+        if keep is not None:
+            mask = np.isin(batch_ids, keep)
+            batch_ids, embs = batch_ids[mask], embs[mask]
+        index.add_with_ids(embs, batch_ids)
+
+    logging.info(f"FAISS index built with {index.ntotal} vectors (dim={index.d}).")
+    return index
+
+
+def backfill_vector_store(store: Optional[VectorStore] = None) -> np.ndarray:
+    """
+    Copy embeddings the store lacks from the database, reading only the
+    columns it needs. Returns the ids of every chunk with an embedding.
+    """
+    store = store or vector_store
+    db_ids = np.array(
+        [cid for (cid,) in db.session.query(Chunk.id).filter(Chunk.embedding.isnot(None)).order_by(Chunk.id)],
+        dtype=np.int64,
+    )
+    missing = np.setdiff1d(db_ids, store.ids())
+    for start in range(0, len(missing), 1000):
+        batch = [int(cid) for cid in missing[start:start + 1000]]
+        rows = (
+            db.session.query(Chunk.id, Chunk.document_id, Chunk.embedding)
+                      .filter(Chunk.id.in_(batch))
+                      .order_by(Chunk.id)
+                      .all()
+        )
+        store.append(
+            [r[0] for r in rows],
+            [r[1] for r in rows],
+            np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows]),
+        )
+    if len(missing):
+        logging.info(f"Backfilled {len(missing)} embeddings into the vector store.")
+    return db_ids
+
+
+def _write_index(index: faiss.Index, path: str):
+    # Write beside the live file and rename, so readers never see a partial file
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def persist_faiss_index(index: faiss.IndexIDMap2, faiss_dir: Optional[str] = None):
+    """Write the global index; chunk ids live inside it, so there is no separate id map."""
+    faiss_dir = faiss_dir or _active_dirs()[1]
+    _ensure_dir(faiss_dir)
+    index_path = os.path.join(faiss_dir, "faiss.index")
+
+    _write_index(index, index_path)
+
+    with open(_stats_path(faiss_dir), "w") as f:
+        json.dump({"vectors": int(index.ntotal)}, f)
+
+    # The index now carries its ids; a leftover legacy map would be stale
+    legacy_map = os.path.join(faiss_dir, "id_map.json")
+    if os.path.exists(legacy_map):
+        os.remove(legacy_map)
+
+    logging.info(f"Persisted FAISS index to {index_path}.")
+
+
+def _migrate_legacy_index(faiss_dir: str) -> faiss.IndexIDMap2:
+    """
+    Indexes written before ids lived inside them are positional, with an
+    id_map.json of {"row": chunk_id}. A non-empty index can't be wrapped, so
+    rebuild it from the vector store, keeping exactly the ids it held.
+    """
+    with open(os.path.join(faiss_dir, "id_map.json"), "r") as f:
+        legacy_ids = np.array([int(cid) for cid in json.load(f).values()], dtype=np.int64)
+    backfill_vector_store()
+    logging.info(f"Migrating legacy FAISS index in {faiss_dir} ({len(legacy_ids)} vectors) to IndexIDMap2.")
+    return build_faiss_index(keep=legacy_ids)
+
+
+def _deltas_dir(faiss_dir: str) -> str:
+    return os.path.join(faiss_dir, "deltas")
+
+
+def delta_paths(faiss_dir: str) -> List[str]:
+    """Delta files of the global index, oldest first."""
+    folder = _deltas_dir(faiss_dir)
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith(".index")]
+
+
+def _clear_deltas(faiss_dir: str):
+    for path in delta_paths(faiss_dir):
+        os.remove(path)
+
+
+def _add_stats_vectors(faiss_dir: str, added: int):
+    try:
+        with open(_stats_path(faiss_dir), "r") as f:
+            vectors = int(json.load(f).get("vectors", 0))
+    except FileNotFoundError:
+        vectors = 0
+    with open(_stats_path(faiss_dir), "w") as f:
+        json.dump({"vectors": vectors + int(added)}, f)
+
+
+def merge_faiss_deltas(faiss_dir: Optional[str] = None):
+    """Fold the delta files into the base global index and delete them."""
+    faiss_dir = faiss_dir or _active_dirs()[1]
+    paths = delta_paths(faiss_dir)
+    if not paths:
+        return
+    index = faiss.read_index(os.path.join(faiss_dir, "faiss.index"))
+    for path in paths:
+        delta = faiss.read_index(path)
+        ids = faiss.vector_to_array(delta.id_map).astype(np.int64)
+        index.add_with_ids(faiss.downcast_index(delta.index).reconstruct_n(0, delta.ntotal), ids)
+    persist_faiss_index(index, faiss_dir)
+    # Readers dedupe chunk ids, so one that pairs the merged base with the
+    # old deltas in between still returns each chunk once
+    _clear_deltas(faiss_dir)
+    logging.info(f"Merged {len(paths)} FAISS delta files into the global index (total={index.ntotal}).")
+
+
+def append_faiss_index(ids: np.ndarray, embeddings: np.ndarray, faiss_dir: Optional[str] = None):
+    """
+    Add vectors to the global index. Once a base index exists they go to a
+    new flat delta file of their own, so an upload writes its own rows, not
+    the corpus; the deltas are folded into the base by compaction, or once
+    FAISS_MAX_DELTAS of them pile up.
+
+    The base is created from the first upload, so below FAISS_MIN_ANN_SIZE
+    it is flat whatever FAISS_INDEX_TYPE says, and appends and delta merges
+    keep its type. Only rebuild_indexes() and compact_indexes() build a new
+    base sized for the whole corpus, and with it the configured ANN type.
+    """
+    faiss_dir = faiss_dir or _active_dirs()[1]
+    index_path = os.path.join(faiss_dir, "faiss.index")
+
+    embs_new = _normalize(embeddings)
+    ids = np.asarray(ids, dtype=np.int64)
+
+    if os.path.exists(os.path.join(faiss_dir, "id_map.json")):
+        idx = _migrate_legacy_index(faiss_dir)
+    elif not os.path.exists(index_path):
+        idx = _with_ids(create_faiss_index(embs_new))
+    else:
+        _ensure_dir(_deltas_dir(faiss_dir))
+        existing = delta_paths(faiss_dir)
+        seq = int(os.path.basename(existing[-1]).split(".")[0]) + 1 if existing else 1
+        delta = faiss.IndexIDMap2(faiss.IndexFlatIP(embs_new.shape[1]))
+        delta.add_with_ids(embs_new, ids)
+        _write_index(delta, os.path.join(_deltas_dir(faiss_dir), f"{seq:08d}.index"))
+        _add_stats_vectors(faiss_dir, len(ids))
+        logging.info(f"FAISS delta {seq} written with {len(ids)} vectors.")
+        if len(existing) + 1 >= FAISS_MAX_DELTAS:
+            merge_faiss_deltas(faiss_dir)
+        return
+
+    idx.add_with_ids(embs_new, ids)
+    persist_faiss_index(idx, faiss_dir)
+
+    logging.info(f"FAISS index appended {len(ids)} vectors (total={idx.ntotal}).")
+
+
+# Per-document partitions: a small IndexIDMap2 per document, keyed by chunk id
+def _doc_index_dir(faiss_dir: str) -> str:
+    return os.path.join(faiss_dir, "docs")
+
+
+def doc_index_path(doc_id: int, faiss_dir: Optional[str] = None) -> str:
+    return os.path.join(_doc_index_dir(faiss_dir or _active_dirs()[1]), f"{doc_id}.index")
+
+
+def append_doc_indexes(
+    ids: np.ndarray,
+    doc_ids: np.ndarray,
+    embeddings: np.ndarray,
+    faiss_dir: Optional[str] = None
+):
+    faiss_dir = faiss_dir or _active_dirs()[1]
+    _ensure_dir(_doc_index_dir(faiss_dir))
+    embs = _normalize(embeddings)
+    docs = np.unique(doc_ids)
+    for doc_id in docs:
+        rows = doc_ids == doc_id
+        path = doc_index_path(int(doc_id), faiss_dir)
+        if os.path.exists(path):
+            index = faiss.read_index(path)
+        else:
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(embs.shape[1]))
+        index.add_with_ids(np.ascontiguousarray(embs[rows]), ids[rows].astype(np.int64))
+        _write_index(index, path)
+
+    logging.info(f"Per-document FAISS indexes updated for {len(docs)} documents.")
+
+
+def _indexed_ids(doc_ids, faiss_dir: str) -> np.ndarray:
+    """Chunk ids already in the partitions of `doc_ids`, read from their id maps."""
+    found = [np.zeros(0, dtype=np.int64)]
+    for doc_id in doc_ids:
+        path = doc_index_path(int(doc_id), faiss_dir)
+        if os.path.exists(path):
+            # Hold the index: its id_map is freed with it
+            index = faiss.read_index(path)
+            found.append(faiss.vector_to_array(index.id_map).astype(np.int64))
+    return np.concatenate(found)
+
+
+# Incremental bookkeeping: every chunk id <= the high-water mark is indexed
+def _high_water_path(faiss_dir: str) -> str:
+    return os.path.join(faiss_dir, "high_water.json")
 
-    norms = np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
-    embeddings = embeddings / norms
 
-    vector_dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(vector_dim)
-    index.add(embeddings)
+def _load_high_water_mark(faiss_dir: str) -> int:
+    path = _high_water_path(faiss_dir)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return int(json.load(f).get("last_chunk_id", 0))
 
-    logging.info(f"FAISS index built with {len(ids)} vectors (dim={vector_dim}).")
-    return index, list(ids)
+    # Indexes persisted before the mark existed: derive it from the id map
+    idmap_path = os.path.join(faiss_dir, "id_map.json")
+    if os.path.exists(idmap_path):
+        with open(idmap_path, "r") as f:
+            return max((int(cid) for cid in json.load(f).values()), default=0)
+    return 0
 
 
-def persist_faiss_index(index: faiss.Index, id_list: List[int]):
-    _ensure_dir(FAISS_INDEX_DIR)
-    index_path = os.path.join(FAISS_INDEX_DIR, "faiss.index")
-    idmap_path = os.path.join(FAISS_INDEX_DIR, "id_map.json")
+def _save_high_water_mark(last_chunk_id: int, faiss_dir: str):
+    _ensure_dir(faiss_dir)
+    with open(_high_water_path(faiss_dir), "w") as f:
+        json.dump({"last_chunk_id": int(last_chunk_id)}, f)
 
-    faiss.write_index(index, index_path)
 
-    mapping = {str(i): int(cid) for i, cid in enumerate(id_list)}
-    with open(idmap_path, "w") as f:
-        json.dump(mapping, f)
+# Deletions: Whoosh deletes for real; the global FAISS index gets tombstones
+# (HNSW and IVF-PQ can't cheaply remove vectors) until compaction rewrites it
+def _stats_path(faiss_dir: str) -> str:
+    return os.path.join(faiss_dir, "stats.json")
 
-    logging.info(f"Persisted FAISS index to {index_path} and id_map (dict) to {idmap_path}.")
 
+def tombstones_path(faiss_dir: str) -> str:
+    return os.path.join(faiss_dir, "tombstones.i64")
 
-def rebuild_faiss_index():
-    logging.info("Rebuilding FAISS index from DB...")
-    chunks = db.session.query(Chunk).all()
-    index, id_map = build_faiss_index(chunks)
-    persist_faiss_index(index, id_map)
+
+def _load_tombstones(faiss_dir: str) -> np.ndarray:
+    path = tombstones_path(faiss_dir)
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=np.int64)
+    return np.fromfile(path, dtype=np.int64)
+
+
+def tombstone_ratio(faiss_dir: Optional[str] = None) -> float:
+    """Share of the global index's vectors that belong to deleted chunks."""
+    faiss_dir = faiss_dir or _active_dirs()[1]
+    try:
+        with open(_stats_path(faiss_dir), "r") as f:
+            vectors = int(json.load(f).get("vectors", 0))
+    except FileNotFoundError:
+        return 0.0
+    return len(_load_tombstones(faiss_dir)) / vectors if vectors else 0.0
+
+
+def remove_document(doc_id: int, chunk_ids: List[int]) -> float:
+    """
+    Drop a deleted document from the published generation: its Whoosh
+    documents, its FAISS partition, tombstones for those of its chunks the
+    global index holds, and its cached answers. Returns the tombstone ratio
+    afterwards.
+    """
+    from .answer_cache import invalidate
+
+    whoosh_dir, faiss_dir = _active_dirs()
+
+    if whoosh_index.exists_in(whoosh_dir):
+        writer = AsyncWriter(whoosh_index.open_dir(whoosh_dir))
+        writer.delete_by_term("document_id", doc_id)
+        writer.commit()
+
+    # Only ids the global index holds and hasn't tombstoned yet: chunks that
+    # never had a vector would inflate the tombstone ratio. The partition has
+    # the same ids as the global index; without one, the vector store does
+    path = doc_index_path(doc_id, faiss_dir)
+    held = _indexed_ids([doc_id], faiss_dir) if os.path.exists(path) else vector_store.ids()
+    chunk_ids = np.setdiff1d(
+        np.intersect1d(np.asarray(chunk_ids, dtype=np.int64), held),
+        _load_tombstones(faiss_dir),
+    )
+    if os.path.exists(path):
+        os.remove(path)
+
+    if len(chunk_ids):
+        _ensure_dir(faiss_dir)
+        with open(tombstones_path(faiss_dir), "ab") as f:
+            f.write(np.asarray(chunk_ids, dtype=np.int64).tobytes())
+
+    publish()
+    invalidate(doc_id)
+    ratio = tombstone_ratio(faiss_dir)
+    logging.info(f"Removed document {doc_id} ({len(chunk_ids)} vectors) from the indexes; tombstones at {ratio:.1%}.")
+    return ratio
+
+
+def compact_indexes(force: bool = False) -> Optional[int]:
+    """
+    Rewrite the vector store and the global FAISS index without deleted
+    chunks, folding in its delta files, clear the tombstones and merge
+    Whoosh segments. Skipped unless
+    `force` or the tombstone ratio is at least COMPACT_TOMBSTONE_RATIO.
+    Returns the published generation, or None when skipped.
+    """
+    whoosh_dir, faiss_dir = _active_dirs()
+    ratio = tombstone_ratio(faiss_dir)
+    if not force and ratio < COMPACT_TOMBSTONE_RATIO:
+        logging.info(f"Tombstones at {ratio:.1%}; compaction not needed.")
+        return None
+
+    live_ids = backfill_vector_store()
+    vector_store.compact(live_ids)
+    if len(vector_store):
+        persist_faiss_index(build_faiss_index(), faiss_dir)
+    else:
+        for name in ("faiss.index", "id_map.json", "stats.json"):
+            if os.path.exists(os.path.join(faiss_dir, name)):
+                os.remove(os.path.join(faiss_dir, name))
+    # The store held the delta rows too, so the new base has them all
+    _clear_deltas(faiss_dir)
+    # The new index holds no dead vectors, so a reader pairing it with the
+    # old tombstones in between only filters ids that are already gone
+    if os.path.exists(tombstones_path(faiss_dir)):
+        os.remove(tombstones_path(faiss_dir))
+
+    if whoosh_index.exists_in(whoosh_dir):
+        whoosh_index.open_dir(whoosh_dir).optimize()
+
+    generation = publish()
+    logging.info(f"Compacted indexes ({ratio:.1%} tombstones) into generation {generation}.")
+    return generation
+
+
+# Full rebuild: one streaming pass into fresh directories
+def _stream_rows(after_id: int, batch_size: int):
+    """Batches of chunk rows (text, no embedding) with id > `after_id`, read through a server-side cursor."""
+    q = (
+        db.session.query(
+            Chunk.id, Chunk.document_id, Chunk.page_number,
+            Chunk.chunk_index, Chunk.text
+        )
+        .filter(Chunk.id > after_id)
+        .order_by(Chunk.id)
+        .yield_per(batch_size)
+    )
+    batch = []
+    for row in q:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _prune_generations(keep: List[str]):
+    """Delete index directories of generations older than those in `keep`."""
+    keep = {os.path.abspath(p) for p in keep}
+    for base in (WHOOSH_INDEX_DIR, FAISS_INDEX_DIR):
+        parent = os.path.dirname(os.path.abspath(base))
+        name = os.path.basename(base.rstrip("/"))
+        if not os.path.isdir(parent):
+            continue
+        for entry in os.listdir(parent):
+            path = os.path.join(parent, entry)
+            if (entry == name or entry.startswith(name + ".")) and path not in keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                logging.info(f"Removed retired index directory {path}.")
+
+
+def rebuild_indexes(batch_size: int = REINDEX_BATCH_SIZE) -> int:
+    """
+    Rebuild Whoosh and FAISS without holding the corpus in memory, into new
+    directories. Chunk text is streamed once from the database into Whoosh,
+    `batch_size` rows at a time, and vectors are read from the memory-mapped
+    vector store in batches of the same size. The manifest then points at
+    them, so queries stay on the old generation until the new one is complete. The
+    generation before the old one is deleted, and every cached answer is
+    dropped. Returns the new generation.
+    """
+    from .answer_cache import invalidate
+    from .ingestion import embed_missing
+
+    # Chunks the embedder failed on during ingestion get another try
+    embed_missing()
+
+    # Microseconds too: a second rebuild within the same second must not
+    # write into the generation it replaces
+    now = time.time()
+    stamp = time.strftime("%Y%m%d%H%M%S", time.localtime(now)) + f"{int(now * 1e6) % 1000000:06d}"
+    whoosh_dir = f"{WHOOSH_INDEX_DIR.rstrip('/')}.{stamp}"
+    faiss_dir = f"{FAISS_INDEX_DIR.rstrip('/')}.{stamp}"
+    logging.info(f"Rebuilding indexes into {whoosh_dir} and {faiss_dir}...")
+
+    ix = _open_whoosh_index(whoosh_dir)
+    writer = ix.writer(limitmb=WHOOSH_WRITER_LIMITMB)
+    committed = False
+    index = None
+    last_id = 0
+    try:
+        # Text for Whoosh; keep going until no rows arrived while the previous pass ran
+        while True:
+            seen = 0
+            for rows in _stream_rows(last_id, batch_size):
+                for r in rows:
+                    writer.add_document(
+                        chunk_id=str(r.id),
+                        document_id=r.document_id,
+                        page_number=r.page_number,
+                        chunk_index=r.chunk_index,
+                        text=r.text
+                    )
+                last_id = rows[-1].id
+                seen += len(rows)
+            if not seen:
+                break
+            logging.info(f"Streamed {seen} chunks into the new generation (last id {last_id}).")
+        writer.commit()
+        committed = True
+
+        # Vectors come from the memory-mapped store, not the embedding column;
+        # the backfill only reads chunks the store lacks. Limited to the rows
+        # Whoosh got, so both indexes cover the same chunks
+        live_ids = backfill_vector_store()
+        live_ids = live_ids[live_ids <= last_id]
+        if len(live_ids):
+            # An IVF-PQ index is trained up front, on a sample from the store
+            index = _with_ids(create_faiss_index(vector_store.sample(FAISS_TRAIN_SAMPLE), total=len(live_ids)))
+            for ids, docs, embs in vector_store.iter_batches(batch_size):
+                keep = np.isin(ids, live_ids)
+                if not keep.any():
+                    continue
+                ids, docs, embs = ids[keep], docs[keep], embs[keep]
+                index.add_with_ids(embs, ids)
+                append_doc_indexes(ids, docs, embs, faiss_dir)
+    except Exception:
+        if not committed:
+            writer.cancel()
+        shutil.rmtree(whoosh_dir, ignore_errors=True)
+        shutil.rmtree(faiss_dir, ignore_errors=True)
+        raise
+
+    if index is not None:
+        persist_faiss_index(index, faiss_dir)
+    _save_high_water_mark(last_id, faiss_dir)
+
+    previous = read_manifest()
+    generation = publish(whoosh_dir=whoosh_dir, faiss_dir=faiss_dir)
+    _prune_generations([whoosh_dir, faiss_dir, previous["whoosh_dir"], previous["faiss_dir"]])
+    invalidate()
+    vectors = index.ntotal if index is not None else 0
+    logging.info(f"Rebuild complete: {vectors} vectors, generation {generation}.")
+    return generation
 
 
 # Combining Indexes
-def build_indexes(reindex_all: bool = False):
-    logging.info(f"Starting index build (reindex_all={reindex_all}).")
+def build_indexes(reindex_all: bool = False, doc_id: Optional[int] = None) -> int:
+    """
+    Index chunks into Whoosh and FAISS. Without `reindex_all` only new
+    chunks are appended to the published generation: those of `doc_id` when
+    given, otherwise every chunk above the high-water mark. An upload
+    therefore costs its own size, not the size of the corpus. Chunks the
+    generation already holds, e.g. streamed in by a rebuild that ran while
+    the upload waited for the index lock, are skipped. Chunks ingestion
+    couldn't embed are embedded first. Cached answers of the documents
+    touched are dropped. Returns how many chunks stay out of the indexes
+    because they still have no embedding.
+    """
+    from .answer_cache import invalidate
+    from .ingestion import embed_missing
+
+    logging.info(f"Starting index build (reindex_all={reindex_all}, doc_id={doc_id}).")
 
     if reindex_all:
-        rebuild_whoosh_index()
-        rebuild_faiss_index()
+        # The rebuild retries the embeddings itself
+        rebuild_indexes()
+        return db.session.query(Chunk).filter(Chunk.embedding.is_(None)).count()
+
+    unembedded = embed_missing(doc_id)
+    if unembedded:
+        logging.warning(f"{unembedded} chunks still have no embedding and are left out of the indexes.")
+
+    whoosh_dir, faiss_dir = _active_dirs()
+    last_id = _load_high_water_mark(faiss_dir)
+    q = db.session.query(Chunk).filter(Chunk.embedding.isnot(None))
+    if doc_id is not None:
+        q = q.filter(Chunk.document_id == doc_id)
     else:
-        new_chunks = db.session.query(Chunk).filter(Chunk.embedding.isnot(None)).all()
-        if new_chunks:
-            build_whoosh_index(new_chunks)
-
-            index_path = os.path.join(FAISS_INDEX_DIR, "faiss.index")
-            idmap_path = os.path.join(FAISS_INDEX_DIR, "id_map.json")
-
-            if new_chunks:
-                ids_new, emb_blobs = zip(*[(c.id, c.embedding) for c in new_chunks])
-                embs_new = np.stack([np.frombuffer(b, dtype=np.float32) for b in emb_blobs])
-                norms = np.linalg.norm(embs_new, axis=1, keepdims=True) + 1e-12
-                embs_new = embs_new / norms
-
-                if os.path.exists(index_path) and os.path.exists(idmap_path):
-                    idx = faiss.read_index(index_path)
-                    with open(idmap_path, "r") as f:
-                        existing_map = json.load(f)
-
-                    start_row = idx.ntotal
-                    idx.add(embs_new)
-
-                    for offset, cid in enumerate(ids_new):
-                        existing_map[str(start_row + offset)] = int(cid)
-
-                    # Rebuild ordered list for persistence
-                    total_rows = idx.ntotal
-                    ordered_ids = [existing_map[str(i)] for i in range(total_rows)]
-                    persist_faiss_index(idx, ordered_ids)
-                else:
-                    idx = faiss.IndexFlatIP(embs_new.shape[1])
-                    idx.add(embs_new)
-                    persist_faiss_index(idx, list(ids_new))
-        else:
-            logging.info("No new chunks to index.")
-
+        q = q.filter(Chunk.id > last_id)
+    new_chunks = q.order_by(Chunk.id).all()
+
+    # Not the high-water mark for doc_id: concurrent ingests commit and index
+    # in either order, so a document's ids may lie below it yet be unindexed
+    indexed = set(_indexed_ids({c.document_id for c in new_chunks}, faiss_dir).tolist())
+    if indexed:
+        new_chunks = [c for c in new_chunks if c.id not in indexed]
+
+    if not new_chunks:
+        logging.info("No new chunks to index.")
+        return unembedded
+
+    with span("index_append"):
+        ids, docs, embs = _chunk_vectors(new_chunks)
+        vector_store.append(ids, docs, embs)
+        build_whoosh_index(new_chunks, whoosh_dir=whoosh_dir)
+        append_faiss_index(ids, embs, faiss_dir)
+        append_doc_indexes(ids, docs, embs, faiss_dir)
+        _save_high_water_mark(max(last_id, new_chunks[-1].id), faiss_dir)
+
+        publish()
+    for touched in np.unique(docs).tolist():
+        invalidate(int(touched))
     logging.info("Index build complete.")
+    return unembedded
@@ -1,52 +1,191 @@
 # app/ingestion.py
 
+import os
 import fitz
 import logging
+import threading
+import multiprocessing
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
 
 from .models import Chunk
 from . import db
-from .embedder import get_or_compute_embedding
-
-
-def extract_and_chunk(doc_id: int, file_path: str, chunk_size: int = 500, overlap: int = 50) -> int:
-    pdf = fitz.open(file_path)
-    chunks = []
-    idx = 0
-
-    for page in pdf:
-        words = page.get_text().split()
-        start = 0
-        while start < len(words):
-            slice_words = words[start : start + chunk_size]
-            text = " ".join(slice_words)
-
-            chunks.append(
-                Chunk(
-                    document_id=doc_id,
-                    page_number=page.number + 1,
-                    chunk_index=idx,
-                    text=text
+from .embedder import embed_texts
+from .chunker import chunk_pages
+from .metrics import span
+from .sentence_index import SentenceIndexBuilder
+
+# Configuration from environment
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", os.cpu_count() or 1))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "16"))
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "256"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    # Reused across uploads; spawn keeps torch/Redis state out of the children.
+    # INGEST_WORKERS threads race here, so create it under a lock
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=INGEST_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
                 )
-            )
+    return _pool
 
-            idx += 1
-            start += chunk_size - overlap
 
-    created = 0
-    if chunks:
-        db.session.add_all(chunks)
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    with fitz.open(file_path) as pdf:
+        return [(n + 1, pdf[n].get_text()) for n in range(start, stop)]
+
+
+def iter_pages(file_path: str, page_count: int) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) in page order. Page ranges are extracted by a
+    process pool, each worker opening its own fitz document; at most two
+    ranges per worker are in flight so memory stays bounded.
+    """
+    ranges = [
+        (start, min(start + INGEST_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, INGEST_PAGES_PER_TASK)
+    ]
+    if INGEST_PROCESSES <= 1 or len(ranges) <= 1:
+        for start, stop in ranges:
+            with span("extract_pages"):
+                pages = _extract_page_range(file_path, start, stop)
+            yield from pages
+        return
+
+    pool = _get_pool()
+    pending = deque()
+    remaining = iter(ranges)
+    for start, stop in remaining:
+        pending.append(pool.submit(_extract_page_range, file_path, start, stop))
+        if len(pending) >= 2 * INGEST_PROCESSES:
+            break
+    while pending:
+        # Time blocked on the pool, i.e. extraction not hidden behind chunking
+        with span("extract_pages"):
+            pages = pending.popleft().result()
+        nxt = next(remaining, None)
+        if nxt is not None:
+            pending.append(pool.submit(_extract_page_range, file_path, *nxt))
+        yield from pages
+
+
+def _embed_chunks(chunks: List[Chunk]) -> int:
+    """Set each chunk's embedding; returns how many were embedded."""
+    try:
+        with span("embed_chunks"):
+            embs = embed_texts([chunk.text for chunk in chunks])
+    except Exception as e:
+        logging.error(f"Failed to embed {len(chunks)} chunks: {e}")
+        return 0
+    for chunk, emb in zip(chunks, embs):
+        chunk.embedding = emb.tobytes()
+    return min(len(chunks), len(embs))
+
+
+def embed_missing(doc_id: Optional[int] = None) -> int:
+    """
+    Embed chunks that were committed without an embedding because the
+    embedder failed during ingestion, those of `doc_id` or all of them.
+    Returns how many still lack one.
+    """
+    q = db.session.query(Chunk.id).filter(Chunk.embedding.is_(None))
+    if doc_id is not None:
+        q = q.filter(Chunk.document_id == doc_id)
+    ids = [cid for (cid,) in q.order_by(Chunk.id)]
+
+    missing = 0
+    for start in range(0, len(ids), INGEST_FLUSH_SIZE):
+        batch = db.session.query(Chunk).filter(Chunk.id.in_(ids[start:start + INGEST_FLUSH_SIZE])).all()
+        missing += len(batch) - _embed_chunks(batch)
+        with span("db_write"):
+            db.session.commit()
+    if ids:
+        logging.info(f"Re-embedded {len(ids) - missing} of {len(ids)} chunks missing an embedding.")
+    return missing
+
+
+def _flush(batch: List[Chunk], sentences: Optional[SentenceIndexBuilder] = None) -> int:
+    with span("db_write"):
+        db.session.add_all(batch)
         db.session.flush()
+    if sentences is not None:
+        for chunk in batch:
+            sentences.add(chunk.id, chunk.text)
+    # Counted here: the commit expires the rows, and reading them back is a SELECT each
+    embedded = _embed_chunks(batch)
+    with span("db_write"):
         db.session.commit()
-        created = len(chunks)
 
-        for chunk in chunks:
-            try:
-                emb = get_or_compute_embedding(str(chunk.id), chunk.text)
-                chunk.embedding = emb.tobytes()
-            except Exception as e:
-                logging.error(f"Failed to embed chunk {chunk.id}: {e}")
+    # Drop the flushed rows from the session so memory stays flat
+    for chunk in batch:
+        db.session.expunge(chunk)
+    return embedded
 
-        # Commit embedding updates
-        db.session.commit()
+
+def extract_and_chunk(
+    doc_id: int,
+    file_path: str,
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    progress: Optional[Callable[..., None]] = None,
+    chunker: Optional[str] = None
+) -> int:
+    with fitz.open(file_path) as pdf:
+        page_count = pdf.page_count
+    if progress:
+        progress(pages_total=page_count, pages_parsed=0)
+
+    created = 0
+    embedded = 0
+    last_page = 0
+    batch: List[Chunk] = []
+    sentences = SentenceIndexBuilder(doc_id)
+
+    def pages():
+        nonlocal last_page
+        for page_number, text in iter_pages(file_path, page_count):
+            last_page = page_number
+            yield page_number, text
+
+    for piece in chunk_pages(pages(), chunk_size, overlap, strategy=chunker):
+        batch.append(
+            Chunk(
+                document_id=doc_id,
+                page_number=piece.page_number,
+                chunk_index=created,
+                text=piece.text,
+                token_count=piece.token_count
+            )
+        )
+        created += 1
+
+        if len(batch) >= INGEST_FLUSH_SIZE:
+            embedded += _flush(batch, sentences)
+            batch = []
+            if progress:
+                progress(pages_parsed=last_page, chunks=created, chunks_embedded=embedded)
+
+    if batch:
+        embedded += _flush(batch, sentences)
+
+    # Optional: the extractive answer path builds a missing index on first use
+    try:
+        with span("sentence_index"):
+            sentences.save()
+    except Exception as e:
+        logging.exception(f"Sentence index for document {doc_id} failed: {e}")
+
+    if progress:
+        progress(pages_parsed=page_count, chunks=created, chunks_embedded=embedded)
 
     return created
@@ -0,0 +1,268 @@
+# app/jobs.py
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+
+from typing import Optional
+
+from .metrics import span
+
+# Configuration from environment
+INGEST_QUEUE = os.getenv("INGEST_QUEUE", "ingest:queue")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOB_TTL = int(os.getenv("JOB_TTL", 86400))
+INDEX_LOCK_TIMEOUT = int(os.getenv("INDEX_LOCK_TIMEOUT", 600))
+REINDEX_LOCK_TIMEOUT = int(os.getenv("REINDEX_LOCK_TIMEOUT", 6 * 3600))
+# How long a request waits for the index lock before handing the work to a job
+INDEX_LOCK_WAIT = float(os.getenv("INDEX_LOCK_WAIT", 5))
+# A worker whose heartbeat is this old is gone; its in-flight jobs get reaped
+WORKER_HEARTBEAT_TTL = int(os.getenv("WORKER_HEARTBEAT_TTL", 30))
+
+# Safe to run twice, so a dead worker's job goes back on the queue; the rest
+# (an ingest commits chunks as it goes) are marked failed instead
+_RETRYABLE = {"index", "reindex", "compact"}
+
+
+def _redis():
+    # Bound by create_app(), so look it up at call time
+    from . import redis_client
+    return redis_client
+
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def enqueue(kind: str, **payload) -> str:
+    job_id = uuid.uuid4().hex
+    r = _redis()
+    pipe = r.pipeline()
+    pipe.hset(_job_key(job_id), mapping={
+        "job_id": job_id,
+        "kind": kind,
+        "status": "queued",
+        "payload": json.dumps(payload),
+        "created_at": time.time(),
+    })
+    pipe.expire(_job_key(job_id), JOB_TTL)
+    pipe.lpush(INGEST_QUEUE, job_id)
+    pipe.execute()
+    logging.info(f"Enqueued {kind} job {job_id}: {payload}")
+    return job_id
+
+
+def update(job_id: str, **fields):
+    _redis().hset(_job_key(job_id), mapping={k: str(v) for k, v in fields.items()})
+
+
+def get_status(job_id: str) -> Optional[dict]:
+    data = _redis().hgetall(_job_key(job_id))
+    if not data:
+        return None
+    data.pop("payload", None)
+    for field in ("pages_total", "pages_parsed", "chunks", "chunks_embedded", "unembedded", "generation"):
+        if field in data:
+            data[field] = int(data[field])
+    if "indexed" in data:
+        data["indexed"] = data["indexed"] == "1"
+    return data
+
+
+def index_lock(timeout: Optional[int] = None, blocking_timeout: Optional[float] = None):
+    """
+    Serializes index writers across worker threads and processes. With
+    `blocking_timeout`, entering raises redis LockError after waiting that
+    long; request handlers use INDEX_LOCK_WAIT so a rebuild can't hold them.
+    """
+    return _redis().lock(
+        "ingest:index-lock",
+        timeout=timeout or INDEX_LOCK_TIMEOUT,
+        blocking_timeout=blocking_timeout,
+    )
+
+
+# Job handlers
+def _run_ingest(job_id: str, doc_id: int, path: str):
+    from .ingestion import extract_and_chunk
+    from .indexer import build_indexes
+
+    update(job_id, status="extracting")
+
+    def progress(**fields):
+        update(job_id, **fields)
+
+    with span("ingest"):
+        count = extract_and_chunk(doc_id, path, progress=progress)
+
+    update(job_id, status="indexing", chunks=count)
+    with index_lock(), span("index_build"):
+        unembedded = build_indexes(reindex_all=False, doc_id=doc_id)
+    # Chunks still unembedded are retried by the next index run
+    update(job_id, status="done", indexed=1, unembedded=unembedded, finished_at=time.time())
+
+
+def _run_index(job_id: str, doc_id: int):
+    from .indexer import build_indexes
+
+    update(job_id, status="indexing")
+    with index_lock(), span("index_build"):
+        unembedded = build_indexes(reindex_all=False, doc_id=doc_id)
+    update(job_id, status="done", indexed=1, unembedded=unembedded, finished_at=time.time())
+
+
+def _run_remove(job_id: str, doc_id: int, chunk_ids: list):
+    from .indexer import remove_document, COMPACT_TOMBSTONE_RATIO
+
+    update(job_id, status="indexing")
+    with index_lock():
+        ratio = remove_document(doc_id, chunk_ids)
+    if ratio >= COMPACT_TOMBSTONE_RATIO:
+        enqueue("compact")
+    update(job_id, status="done", indexed=1, finished_at=time.time())
+
+
+def _run_reindex(job_id: str):
+    from .indexer import rebuild_indexes
+
+    update(job_id, status="indexing")
+    with index_lock(timeout=REINDEX_LOCK_TIMEOUT), span("index_rebuild"):
+        generation = rebuild_indexes()
+    update(job_id, status="done", indexed=1, generation=generation, finished_at=time.time())
+
+
+def _run_compact(job_id: str, force: bool = False):
+    from .indexer import compact_indexes
+
+    update(job_id, status="indexing")
+    with index_lock(timeout=REINDEX_LOCK_TIMEOUT), span("index_compact"):
+        generation = compact_indexes(force=force)
+    fields = {"status": "done", "finished_at": time.time()}
+    if generation is not None:
+        fields.update(indexed=1, generation=generation)
+    update(job_id, **fields)
+
+
+HANDLERS = {
+    "ingest": _run_ingest,
+    "index": _run_index,
+    "remove": _run_remove,
+    "reindex": _run_reindex,
+    "compact": _run_compact,
+}
+
+
+def run_job(job_id: str):
+    data = _redis().hgetall(_job_key(job_id))
+    if not data:
+        logging.warning(f"Job {job_id} expired before it ran.")
+        return
+
+    handler = HANDLERS.get(data.get("kind"))
+    if handler is None:
+        update(job_id, status="failed", error=f"Unknown job kind {data.get('kind')}")
+        return
+
+    update(job_id, status="running", started_at=time.time())
+    try:
+        handler(job_id, **json.loads(data.get("payload") or "{}"))
+    except Exception as e:
+        logging.exception(f"Job {job_id} failed: {e}")
+        update(job_id, status="failed", error=str(e))
+
+
+# Reliable delivery: a worker moves each job into its own processing list and
+# removes it when done, so the jobs of a worker that dies stay visible
+def _processing_registry() -> str:
+    return f"{INGEST_QUEUE}:processing"
+
+
+def _heartbeat_key(worker_id: str) -> str:
+    return f"{INGEST_QUEUE}:worker:{worker_id}"
+
+
+def _heartbeat(worker_id: str):
+    _redis().set(_heartbeat_key(worker_id), time.time(), ex=WORKER_HEARTBEAT_TTL)
+
+
+def reap_stale_jobs() -> int:
+    """
+    Recover jobs left in the processing lists of workers whose heartbeat
+    expired: requeue retryable kinds, mark the others failed. Returns how
+    many jobs were recovered.
+    """
+    r = _redis()
+    reaped = 0
+    for processing, worker_id in r.hgetall(_processing_registry()).items():
+        if r.exists(_heartbeat_key(worker_id)):
+            continue
+        while True:
+            job_id = r.rpop(processing)
+            if job_id is None:
+                break
+            reaped += 1
+            kind = r.hget(_job_key(job_id), "kind")
+            if kind in _RETRYABLE:
+                update(job_id, status="queued")
+                r.lpush(INGEST_QUEUE, job_id)
+                logging.warning(f"Requeued {kind} job {job_id} of dead worker {worker_id}.")
+            elif kind is not None:
+                update(job_id, status="failed", error="The worker stopped while running this job.",
+                       finished_at=time.time())
+                logging.warning(f"Marked {kind} job {job_id} of dead worker {worker_id} as failed.")
+        r.hdel(_processing_registry(), processing)
+    return reaped
+
+
+def _worker_loop(app, stop: threading.Event, processing: str):
+    r = _redis()
+    while not stop.is_set():
+        job_id = r.blmove(INGEST_QUEUE, processing, 5, src="RIGHT", dest="LEFT")
+        if not job_id:
+            continue
+        with app.app_context():
+            try:
+                run_job(job_id)
+            finally:
+                r.lrem(processing, 1, job_id)
+                from . import db
+                db.session.remove()
+
+
+def work(app, concurrency: int = INGEST_WORKERS):
+    """Run `concurrency` worker threads until interrupted."""
+    r = _redis()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    _heartbeat(worker_id)
+    reap_stale_jobs()
+
+    stop = threading.Event()
+    threads = []
+    for i in range(max(1, concurrency)):
+        processing = f"{_processing_registry()}:{worker_id}:{i}"
+        r.hset(_processing_registry(), processing, worker_id)
+        threads.append(threading.Thread(
+            target=_worker_loop, args=(app, stop, processing), name=f"ingest-{i}", daemon=True
+        ))
+    for t in threads:
+        t.start()
+    logging.info(f"Ingestion worker {worker_id} started with {len(threads)} threads on {INGEST_QUEUE}.")
+    next_beat = 0.0
+    try:
+        while any(t.is_alive() for t in threads):
+            if time.monotonic() >= next_beat:
+                _heartbeat(worker_id)
+                reap_stale_jobs()
+                next_beat = time.monotonic() + WORKER_HEARTBEAT_TTL / 3
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+        # Threads finished their jobs, so the lists are empty
+        r.delete(_heartbeat_key(worker_id))
+        r.hdel(_processing_registry(), *[f"{_processing_registry()}:{worker_id}:{i}" for i in range(len(threads))])
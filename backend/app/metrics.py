@@ -0,0 +1,264 @@
+# app/metrics.py
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Configuration from environment
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "False")
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5"))
+METRICS_TTL = int(os.getenv("METRICS_TTL", "60"))
+
+PREFIX = "notes"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+
+_HELP = {
+    "stage_seconds": ("histogram", "Time spent in each pipeline stage."),
+    "http_request_seconds": ("histogram", "HTTP request latency by endpoint; streamed responses until their last byte."),
+    "http_requests_total": ("counter", "HTTP requests by endpoint and status."),
+    "answers_total": ("counter", "Answers by mode (generative or extractive)."),
+    "cache_lookups_total": ("counter", "Cache lookups by cache and result (local, redis, hit or miss)."),
+    "index_generation": ("gauge", "Index generation served by this process."),
+    "index_vectors": ("gauge", "Vectors in the global FAISS index, tombstones included."),
+    "index_documents": ("gauge", "Chunks in the Whoosh index."),
+    "index_tombstones": ("gauge", "Deleted chunk ids still present in the global FAISS index."),
+    "vector_store_rows": ("gauge", "Rows in the memory-mapped vector store."),
+    "model_load_seconds": ("gauge", "Time taken to load each model."),
+    "startup_seconds": ("gauge", "App startup time by phase."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Per-request stage timings in ms; None unless the request asked for them
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("timings", default=None)
+# Retrieval threads add to the same request's dict as the request thread
+_timings_lock = threading.Lock()
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    """
+    In-process counters, gauges and histograms rendered in the Prometheus
+    text format. Each process publishes a snapshot to Redis every
+    METRICS_PUBLISH_INTERVAL seconds; /metrics sums the live snapshots, so
+    one scrape covers every gunicorn worker and the ingestion worker.
+    Gauges are merged by max, since every process reports the same index.
+    """
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self._collectors: List[Callable[["Metrics"], None]] = []
+        self._lock = threading.Lock()
+        self._publisher = None
+        self._pid = None
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+        self._ensure_publisher()
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = float(value)
+        self._ensure_publisher()
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            # One slot per bucket plus +Inf, then sum
+            hist = self._histograms.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+            hist[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            hist[-1] += seconds
+        self._ensure_publisher()
+
+    def collector(self, fn: Callable[["Metrics"], None]):
+        """Register `fn(metrics)` to refresh gauges just before a snapshot is taken."""
+        self._collectors.append(fn)
+        return fn
+
+    def snapshot(self) -> dict:
+        for fn in self._collectors:
+            try:
+                fn(self)
+            except Exception as e:
+                logging.warning(f"Metrics collector {fn.__name__} failed: {e}")
+        with self._lock:
+            return {
+                "counters": [[n, dict(l), v] for (n, l), v in self._counters.items()],
+                "gauges": [[n, dict(l), v] for (n, l), v in self._gauges.items()],
+                "histograms": [[n, dict(l), list(h)] for (n, l), h in self._histograms.items()],
+            }
+
+    # Cross-process publishing
+    def _key(self) -> str:
+        return f"metrics:proc:{socket.gethostname()}:{os.getpid()}"
+
+    def _ensure_publisher(self):
+        if self._publisher is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._publisher is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._publisher = threading.Thread(target=self._publish_loop, name="metrics-publisher", daemon=True)
+                self._publisher.start()
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(METRICS_PUBLISH_INTERVAL)
+            self.publish()
+
+    def publish(self):
+        from . import redis_client
+        if redis_client is None:
+            return
+        try:
+            redis_client.set(self._key(), json.dumps(self.snapshot()), ex=METRICS_TTL)
+        except Exception as e:
+            logging.debug(f"Publishing metrics failed: {e}")
+
+    def _snapshots(self) -> Iterator[dict]:
+        from . import redis_client
+        yield self.snapshot()
+        if redis_client is None:
+            return
+        own = self._key()
+        try:
+            for key in redis_client.scan_iter(match="metrics:proc:*", count=100):
+                if key == own:
+                    continue
+                blob = redis_client.get(key)
+                if blob:
+                    yield json.loads(blob)
+        except Exception as e:
+            logging.warning(f"Reading published metrics failed, serving this process only: {e}")
+
+    def render(self) -> str:
+        """Prometheus text exposition of every live process's metrics."""
+        counters: Dict[Tuple[str, Labels], float] = {}
+        gauges: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], list] = {}
+        for snap in self._snapshots():
+            for name, labels, value in snap.get("counters", []):
+                key = (name, _labels(labels))
+                counters[key] = counters.get(key, 0.0) + value
+            for name, labels, value in snap.get("gauges", []):
+                key = (name, _labels(labels))
+                gauges[key] = max(gauges.get(key, value), value)
+            for name, labels, hist in snap.get("histograms", []):
+                key = (name, _labels(labels))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], hist)]
+                else:
+                    histograms[key] = list(hist)
+
+        lines: List[str] = []
+        for series in (counters, gauges, histograms):
+            for name in sorted({n for n, _ in series}):
+                kind, text = _HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {PREFIX}_{name} {text}")
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+                for (n, labels), value in sorted(series.items()):
+                    if n != name:
+                        continue
+                    if series is histograms:
+                        lines.extend(_histogram_lines(name, labels, value))
+                    else:
+                        lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _histogram_lines(name: str, labels: Labels, hist: list) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], hist[:-1]):
+        cumulative += count
+        le = bound if isinstance(bound, str) else f"{bound:g}"
+        lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+    lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {hist[-1]:.6f}")
+    lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {cumulative}")
+    return lines
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage into the stage histogram and, if requested, the response timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("stage_seconds", elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            with _timings_lock:
+                timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000.0, 3)
+
+
+def start_timings() -> Dict[str, float]:
+    """Collect span timings of the current request (and threads it hands work to) into a dict."""
+    timings: Dict[str, float] = {}
+    _timings.set(timings)
+    return timings
+
+
+def init_app(app):
+    """Per-request latency and status counters, and a clean timings context for each request."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request():
+        _timings.set(None)
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            method = request.method
+
+            def observe():
+                metrics.observe("http_request_seconds", time.perf_counter() - started,
+                                endpoint=endpoint, method=method)
+
+            # A streamed body (/query/stream) is only sent after this hook, so
+            # time it to the end of the stream rather than to the headers
+            if response.is_streamed:
+                response.call_on_close(observe)
+            else:
+                observe()
+            metrics.inc("http_requests_total", endpoint=endpoint, method=method,
+                        status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _clear_timings(exc=None):
+        _timings.set(None)
@@ -26,6 +26,7 @@ class Chunk(db.Model):
     page_number = db.Column(db.Integer, nullable=False)
     chunk_index = db.Column(db.Integer, nullable=False)
     text = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=True)
     embedding = db.Column(db.LargeBinary, nullable=True)
 
     document = db.relationship("Document", back_populates="chunks")
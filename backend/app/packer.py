@@ -0,0 +1,161 @@
+# app/packer.py
+
+import os
+import logging
+
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .chunker import split_sentences
+from . import sentence_index
+
+# Configuration from environment
+# Whole encoder input, prompt text and special tokens included
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "512"))
+
+PROMPT_HEADER = (
+    "Summarize the following document context to answer the question. "
+    "If the answer is not present, say: I couldn't find that in the uploaded document.\n\n"
+    "Question: {question}\n\n"
+    "Context:"
+)
+PROMPT_FOOTER = "\n\nSummary:"
+
+
+class PackedPrompt(NamedTuple):
+    input_ids: List[int]
+    chunk_ids: List[int]
+    sentences: int
+
+
+class _Candidate(NamedTuple):
+    score: float
+    rank: int
+    position: int
+    chunk: object
+    text: str
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _candidates(question: str, chunks: List) -> List[_Candidate]:
+    """Every sentence of `chunks` with its BM25 score from the document's sentence index."""
+    out: List[_Candidate] = []
+    for rank, chunk in enumerate(chunks):
+        index = None
+        try:
+            index = sentence_index.load(int(chunk.document_id))
+        except Exception as e:
+            logging.warning(f"No sentence index for document {chunk.document_id}: {e}")
+
+        if index is not None and int(chunk.id) in index.chunk_rows:
+            first, end = index.chunk_rows[int(chunk.id)]
+            rows = np.arange(first, end)
+            texts = [index.sentences[r] for r in rows]
+            scores = index.bm25(question, rows).tolist()
+        else:
+            # Unscored, so these only fill the budget in retrieval order
+            texts = split_sentences(chunk.text or "")
+            scores = [0.0] * len(texts)
+        out.extend(_Candidate(s, rank, pos, chunk, t) for pos, (s, t) in enumerate(zip(scores, texts)))
+    return out
+
+
+def _special_tokens(tokenizer) -> Tuple[List[int], List[int]]:
+    """The ids a tokenizer puts before and after a single sequence, e.g. <s> ... </s>."""
+    bare = tokenizer("a", add_special_tokens=False)["input_ids"]
+    full = tokenizer("a", add_special_tokens=True)["input_ids"]
+    for start in range(len(full) - len(bare) + 1):
+        if full[start:start + len(bare)] == bare:
+            return full[:start], full[start + len(bare):]
+    return [], []
+
+
+# Shortest window-edge fragment treated as a repeat of a longer sentence
+_MIN_FRAGMENT = 30
+
+
+def _overlaps(short: str, long: str) -> bool:
+    # A window edge cuts a sentence, so its fragment is a prefix or a suffix
+    return len(short) >= _MIN_FRAGMENT and (long.startswith(short) or long.endswith(short))
+
+
+def _is_duplicate(norm: str, kept: List[str]) -> bool:
+    # Chunk overlap repeats sentences, whole or cut at a window edge; a short
+    # sentence merely contained in a longer one is kept
+    return any(
+        norm == other or _overlaps(norm, other) or _overlaps(other, norm)
+        for other in kept
+    )
+
+
+def pack_context(tokenizer, question: str, chunks: List, budget: Optional[int] = None) -> PackedPrompt:
+    """
+    Build the generator's encoder input within `budget` tokens. Sentences
+    of the retrieved chunks are taken best-BM25-first, skipping repeats
+    from chunk overlap, until the budget is spent; they are then laid out
+    by chunk rank and position. Sentences are tokenized once, in a single
+    batch, and the ids are assembled directly.
+    """
+    budget = min(budget or PROMPT_TOKEN_BUDGET, tokenizer.model_max_length)
+
+    def ids(texts: List[str]) -> List[List[int]]:
+        return tokenizer(texts, add_special_tokens=False)["input_ids"] if texts else []
+
+    prefix, suffix = _special_tokens(tokenizer)
+    header, footer = ids([PROMPT_HEADER.format(question=question), PROMPT_FOOTER])
+    fixed = len(prefix) + len(header) + len(footer) + len(suffix)
+    if fixed > budget:
+        # A question longer than the budget keeps its start
+        header = header[:max(0, len(header) - (fixed - budget))]
+        fixed = budget
+
+    candidates = _candidates(question, chunks)
+    markers = {}
+    for c in candidates:
+        markers.setdefault(c.rank, f"\n(page {c.chunk.page_number})")
+    rank_order = sorted(markers)
+    marker_ids = dict(zip(rank_order, ids([markers[r] for r in rank_order])))
+    # Leading space: byte-level BPE tokenizes a word differently at the start of a string
+    sentence_ids = ids([" " + c.text for c in candidates])
+
+    # Matching sentences by score; with none, the top chunks in reading order
+    order = sorted(range(len(candidates)), key=lambda i: (-candidates[i].score, candidates[i].rank, candidates[i].position))
+    if any(candidates[i].score > 0 for i in order):
+        order = [i for i in order if candidates[i].score > 0]
+
+    used = fixed
+    picked: List[int] = []
+    kept: List[str] = []
+    opened = set()
+    for i in order:
+        c = candidates[i]
+        norm = _normalize(c.text)
+        if not norm or _is_duplicate(norm, kept):
+            continue
+        cost = len(sentence_ids[i]) + (0 if c.rank in opened else len(marker_ids[c.rank]))
+        if used + cost > budget:
+            continue
+        used += cost
+        picked.append(i)
+        kept.append(norm)
+        opened.add(c.rank)
+
+    body: List[int] = []
+    chunk_ids: List[int] = []
+    for i in sorted(picked, key=lambda i: (candidates[i].rank, candidates[i].position)):
+        c = candidates[i]
+        if not chunk_ids or chunk_ids[-1] != int(c.chunk.id):
+            body.extend(marker_ids[c.rank])
+            chunk_ids.append(int(c.chunk.id))
+        body.extend(sentence_ids[i])
+
+    return PackedPrompt(prefix + header + body + footer + suffix, chunk_ids, len(picked))
+
+
+def pad_batch(tokenizer, batch: List[List[int]]):
+    """Pad packed prompts into model inputs."""
+    return tokenizer.pad({"input_ids": batch}, padding=True, return_tensors="pt")
@@ -0,0 +1,73 @@
+# app/registry.py
+
+import time
+import logging
+import threading
+
+from typing import Any, Callable, Dict, Iterable
+
+from .metrics import metrics
+
+
+class ModelRegistry:
+    """
+    Named, lazily-built models. Modules register a loader at import time; the
+    model is built on the first get() and shared by every later caller.
+    Load times are kept so startup cost can be reported per component.
+    """
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._timings: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str) -> Any:
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"No model registered as {name!r}")
+
+        with self._locks[name]:
+            if name not in self._models:
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self.record(f"load:{name}", time.perf_counter() - start)
+                logging.info(f"Loaded {name} in {self._timings[f'load:{name}']:.2f}s")
+        return self._models[name]
+
+    def loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def warm_up(self, names: Iterable[str]):
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                logging.exception(f"Warm-up of {name} failed: {e}")
+
+    def record(self, component: str, seconds: float):
+        self._timings[component] = round(seconds, 4)
+
+    def timings(self) -> Dict[str, float]:
+        return dict(self._timings)
+
+
+registry = ModelRegistry()
+
+
+@metrics.collector
+def _timing_gauges(m):
+    for component, seconds in registry.timings().items():
+        kind, _, name = component.partition(":")
+        if kind == "load":
+            m.set("model_load_seconds", seconds, model=name)
+        elif kind == "startup":
+            m.set("startup_seconds", seconds, phase=name)
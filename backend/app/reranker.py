@@ -0,0 +1,89 @@
+# app/reranker.py
+
+import os
+import logging
+
+from typing import List, Tuple
+
+from .backends import backend_for, quantize
+from .cache import TwoLevelCache, hash_key, normalize_question
+from .embedder import redis_client
+from .metrics import span
+from .registry import registry
+
+# Configuration from environment
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "8192"))
+RERANK_CACHE_TTL = int(os.getenv("RERANK_CACHE_TTL", "3600"))
+
+# Generous upper bound on characters per token, so the tokenizer never
+# chews through text the max_length truncation would discard anyway
+_CHARS_PER_TOKEN = 8
+
+
+def _build_cross_encoder():
+    from sentence_transformers import CrossEncoder
+
+    backend = backend_for("rerank")
+    if backend == "onnx":
+        # sentence-transformers exports through optimum itself
+        return CrossEncoder(CROSS_ENCODER_MODEL, max_length=RERANK_MAX_LENGTH, backend="onnx")
+    model = CrossEncoder(CROSS_ENCODER_MODEL, max_length=RERANK_MAX_LENGTH)
+    if backend == "int8":
+        quantize(model.model)
+    return model
+
+
+registry.register("cross_encoder", _build_cross_encoder)
+
+# Scores depend on the model and how it runs, so both are in the namespace
+score_cache = TwoLevelCache(
+    f"rerank:{CROSS_ENCODER_MODEL}:{backend_for('rerank')}",
+    redis_client,
+    max_items=RERANK_CACHE_SIZE,
+    ttl=RERANK_CACHE_TTL,
+    dumps=lambda score: repr(float(score)).encode("utf-8"),
+    loads=lambda blob: float(blob),
+)
+
+
+def _fetch_texts(chunk_ids: List[int]) -> dict:
+    from .models import Chunk
+    from . import db
+
+    rows = db.session.query(Chunk.id, Chunk.text).filter(Chunk.id.in_(chunk_ids)).all()
+    return {cid: text for cid, text in rows if text}
+
+
+def rerank(query: str, candidates: List[Tuple[int, float]], cross_encoder) -> List[Tuple[int, float]]:
+    """
+    Score (query, chunk) pairs with the cross-encoder. Cached scores are
+    reused per (question hash, chunk id); the rest are fetched with one IN
+    query and predicted in RERANK_BATCH_SIZE batches. Candidates whose chunk
+    no longer exists are dropped.
+    """
+    if not candidates:
+        return []
+
+    q_hash = hash_key(normalize_question(query))
+    keys = {cid: hash_key(q_hash, cid) for cid, _ in candidates}
+    cached = score_cache.get_many(list(keys.values()))
+    scores = {cid: cached[key] for cid, key in keys.items() if key in cached}
+
+    missing = [cid for cid in keys if cid not in scores]
+    if missing:
+        texts = _fetch_texts(missing)
+        ids = [cid for cid in missing if cid in texts]
+        limit = RERANK_MAX_LENGTH * _CHARS_PER_TOKEN
+        pairs = [(query, texts[cid][:limit]) for cid in ids]
+        if pairs:
+            with span("cross_encoder"):
+                preds = cross_encoder.predict(pairs, batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+            fresh = {cid: float(s) for cid, s in zip(ids, preds)}
+            scores.update(fresh)
+            score_cache.set_many({keys[cid]: s for cid, s in fresh.items()})
+        logging.debug(f"Re-ranked {len(pairs)} pairs, {len(keys) - len(missing)} cached.")
+
+    return [(cid, scores[cid]) for cid, _ in candidates if cid in scores]
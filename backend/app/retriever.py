@@ -1,121 +1,296 @@
 # app/retriever.py
 
 import os
+import json
 import logging
+import threading
+import contextvars
 import faiss
+import numpy as np
 
-from typing import List, Optional, Tuple, Dict
-from whoosh import index as whoosh_index
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple, Dict
 from whoosh.qparser import MultifieldParser, OrGroup
 from whoosh import scoring
-from sentence_transformers import CrossEncoder
-from app.embedder import get_query_embedding
+from whoosh.query import Term
+from app.embedder import get_query_embedding, redis_client
+from app.index_manager import index_manager, IndexSnapshot
+from app.cache import TwoLevelCache, hash_key, normalize_question
+from app.reranker import rerank
+from app.fusion import fuse, FUSION_METHOD
+from app.metrics import span
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
 
 # Configuration from environment
-WHOOSH_INDEX_DIR = os.getenv("WHOOSH_INDEX_DIR", "indexes/whoosh_index")
-FAISS_INDEX_DIR  = os.getenv("FAISS_INDEX_DIR",  "indexes/faiss_index")
-
-if whoosh_index.exists_in(WHOOSH_INDEX_DIR):
-    try:
-        ix = whoosh_index.open_dir(WHOOSH_INDEX_DIR)
-        logging.info(f"Loaded Whoosh index from {WHOOSH_INDEX_DIR}")
-    except Exception as e:
-        logging.exception(f"Failed to open Whoosh index at {WHOOSH_INDEX_DIR}: {e}")
-        ix = None
-else:
-    logging.warning(f"Whoosh index not found in {WHOOSH_INDEX_DIR}")
-    ix = None
-
-faiss_index = None
-id_map: Dict[str, int] = {}
-try:
-    idx_file = os.path.join(FAISS_INDEX_DIR, "faiss.index")
-    id_map_file = os.path.join(FAISS_INDEX_DIR, "id_map.json")
-    if os.path.exists(idx_file):
-        faiss_index = faiss.read_index(idx_file)
-        logging.info(f"Loaded FAISS index from {idx_file}")
-    else:
-        logging.warning(f"FAISS index file not found at {idx_file}")
-    if os.path.exists(id_map_file):
-        import json
-        with open(id_map_file, "r", encoding="utf-8") as f:
-            id_map = json.load(f)
-        logging.info(f"Loaded FAISS id_map from {id_map_file}")
-    else:
-        logging.warning(f"id_map.json not found at {id_map_file}")
-except Exception as e:
-    logging.exception(f"Failed to load FAISS index/id_map: {e}")
-    faiss_index = None
-    id_map = {}
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "600"))
+RETRIEVE_TOP_K_BM25 = int(os.getenv("RETRIEVE_TOP_K_BM25", "10"))
+RETRIEVE_TOP_K_VECTOR = int(os.getenv("RETRIEVE_TOP_K_VECTOR", "10"))
+RETRIEVE_PARALLEL = os.getenv("RETRIEVE_PARALLEL", "1") not in ("0", "false", "False")
+# Two branches per in-flight query. A branch that misses the deadline keeps its
+# thread until it finishes, so size this for the worker's concurrent queries
+# plus the slow branches of the last deadline's worth of them
+RETRIEVE_THREADS = int(os.getenv("RETRIEVE_THREADS", "8"))
+# Latency budget for the two retrieval branches; 0 waits for both
+RETRIEVE_DEADLINE_MS = float(os.getenv("RETRIEVE_DEADLINE_MS", "0"))
+
+def _load_result(blob: bytes) -> dict:
+    data = json.loads(blob)
+    return {"hits": [(int(cid), float(score)) for cid, score in data["hits"]], "sources": data["sources"]}
+
+
+# Ranked hits, with the sources that produced them, keyed by question,
+# document and index generation; a new generation changes every key, so a
+# rebuild invalidates stale entries
+result_cache = TwoLevelCache(
+    "hits:v2",
+    redis_client,
+    max_items=RESULT_CACHE_SIZE,
+    ttl=RESULT_CACHE_TTL,
+    dumps=lambda result: json.dumps(result).encode("utf-8"),
+    loads=_load_result,
+)
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    # Created lazily and per process: a pool forked from a preloaded master has no threads
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=RETRIEVE_THREADS, thread_name_prefix="retrieve")
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def faiss_search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None
+) -> Optional[faiss.SearchParameters]:
+    """Per-query knobs for approximate indexes; None for exact ones."""
+    inner = index
+    if isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(inner.index)
+    if faiss.try_extract_index_ivf(inner) is not None:
+        return faiss.SearchParametersIVF(nprobe=nprobe or FAISS_NPROBE)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or FAISS_EF_SEARCH)
+    return None
+
 
 def retrieve(
     query: str,
-    top_k_bm25: int = 5,
-    top_k_faiss: int = 5,
+    top_k_bm25: Optional[int] = None,
+    top_k_faiss: Optional[int] = None,
     top_n: int = 5,
-    cross_encoder: Optional[CrossEncoder] = None
+    cross_encoder: Optional["CrossEncoder"] = None,
+    doc_id: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    use_cache: bool = True,
+    fusion: Optional[str] = None,
+    weights: Optional[Dict[str, float]] = None,
+    deadline_ms: Optional[float] = None,
+    details: Optional[dict] = None
 ) -> List[Tuple[int, float]]:
-    results: Dict[int, float] = {}
+    """
+    Hybrid BM25 + vector retrieval. With `doc_id` both searches are confined
+    to that document: Whoosh filters on `document_id` and FAISS searches the
+    document's own partition, so cost scales with the document, not the corpus.
+    `nprobe`/`ef_search` tune IVF/HNSW global indexes for this query.
 
-    if ix:
-        try:
-            raw_q = (query or "").strip()
-            if raw_q:
-                parser = MultifieldParser(["text"], schema=ix.schema, group=OrGroup.factory(0.9))
-                q = parser.parse(raw_q)
-                if str(q).strip() not in ("", "()", "[]"):
-                    with ix.searcher(weighting=scoring.BM25F()) as searcher:
-                        hits = searcher.search(q, limit=top_k_bm25)
-                        for hit in hits:
-                            cid_val = hit.get("chunk_id") or hit.get("id") or hit.get("pk")
-                            try:
-                                cid = int(cid_val)
-                            except Exception:
-                                continue
-                            score = float(hit.score)
-                            results[cid] = max(results.get(cid, 0.0), score)
-            else:
-                logging.info("Empty query; skipping BM25.")
-        except Exception as e:
-            logging.exception(f"Whoosh BM25 search failed: {e}")
+    The two candidate lists (depths RETRIEVE_TOP_K_BM25/RETRIEVE_TOP_K_VECTOR
+    unless given) are merged by `fusion` (see app.fusion) with per-source
+    `weights`, then optionally re-ranked by the cross-encoder.
 
-    if faiss_index is not None:
-        try:
-            from app.embedder import get_query_embedding
-            q_emb = get_query_embedding(query)
-            D, I = faiss_index.search(q_emb, top_k_faiss)
-            for dist, idx in zip(D[0], I[0]):
-                if idx < 0:
-                    continue
-                cid = int(id_map.get(str(idx), -1))
-                if cid == -1:
-                    continue
-                score = 1.0 / (1.0 + float(dist))
-                results[cid] = max(results.get(cid, 0.0), score)
-        except Exception as e:
-            logging.exception(f"FAISS search failed: {e}")
+    Both branches run concurrently on a thread pool (RETRIEVE_PARALLEL). With
+    a deadline (`deadline_ms`, default RETRIEVE_DEADLINE_MS) only the branches
+    finished in time are fused; pass a `details` dict to learn which
+    `sources` contributed, which `timed_out` and which failed (`errors`).
+    Partial results are not cached.
+    """
+    top_k_bm25 = top_k_bm25 or RETRIEVE_TOP_K_BM25
+    top_k_faiss = top_k_faiss or RETRIEVE_TOP_K_VECTOR
+    fusion = fusion or FUSION_METHOD
+
+    # One snapshot per query: a reload mid-query cannot mix generations
+    snapshot = index_manager.current()
+
+    key = None
+    if use_cache:
+        key = hash_key(
+            normalize_question(query), doc_id, snapshot.generation,
+            top_k_bm25, top_k_faiss, top_n, nprobe, ef_search, cross_encoder is not None,
+            fusion, sorted((weights or {}).items()),
+        )
+        cached = result_cache.get(key)
+        if cached is not None:
+            if details is not None:
+                details.update(sources=cached["sources"], timed_out=[], errors=[])
+            return cached["hits"]
 
-    candidates: List[Tuple[int, float]] = list(results.items())
+    branches = {
+        "bm25": (_bm25_hits, (snapshot, query, top_k_bm25, doc_id)),
+        "vector": (_vector_hits, (snapshot, query, top_k_faiss, doc_id, nprobe, ef_search)),
+    }
+    sources, timed_out, errors = _run_branches(branches, deadline_ms)
+    contributed = sorted(name for name, hits in sources.items() if hits)
+    if details is not None:
+        details.update(sources=contributed, timed_out=timed_out, errors=errors)
+    with span("fuse"):
+        candidates = fuse(sources, fusion, weights)
 
     if cross_encoder and candidates:
         try:
-            from app.models import Chunk
-            pairs: List[Tuple[str, str]] = []
-            ids: List[int] = []
-            for cid, _ in candidates:
-                chunk = Chunk.query.get(cid)
-                if not chunk:
-                    continue
-                chunk_text: str = getattr(chunk, "text", None) or getattr(chunk, "content", None) or ""
-                if not chunk_text:
-                    continue
-                pairs.append((query, chunk_text))
-                ids.append(cid)
-            if pairs:
-                scores = cross_encoder.predict(pairs)
-                candidates = list(zip(ids, [float(s) for s in scores]))
+            with span("rerank"):
+                reranked = rerank(query, candidates, cross_encoder)
+            if reranked:
+                candidates = sorted(reranked, key=lambda x: x[1], reverse=True)
         except Exception as e:
             logging.exception(f"CrossEncoder re-rank failed: {e}")
 
-    candidates = sorted(candidates, key=lambda x: x[1], reverse=True)
-    return candidates[:top_n]
+    hits = candidates[:top_n]
+    if key is not None and not timed_out and not errors:
+        result_cache.set(key, {"hits": hits, "sources": contributed})
+    return hits
+
+
+def _run_branches(branches: dict, deadline_ms: Optional[float]) -> Tuple[Dict[str, list], List[str], List[str]]:
+    """
+    Run each retrieval branch; returns (hits per finished source, sources
+    that missed the deadline, sources that failed). A failed source
+    contributes no hits. FAISS, torch and Redis release the GIL while they
+    work, so the query embedding and vector search overlap BM25.
+    """
+    sources: Dict[str, list] = {}
+    errors: List[str] = []
+
+    def collect(name: str, result: Callable[[], list]):
+        try:
+            sources[name] = result()
+        except Exception as e:
+            logging.exception(f"Retrieval branch {name} failed: {e}")
+            sources[name] = []
+            errors.append(name)
+
+    if not RETRIEVE_PARALLEL:
+        for name, (fn, args) in branches.items():
+            collect(name, lambda: fn(*args))
+        return sources, [], sorted(errors)
+
+    deadline_ms = RETRIEVE_DEADLINE_MS if deadline_ms is None else deadline_ms
+    pool = _get_pool()
+    # Each branch runs in a copy of the caller's context so its spans land in the request timings
+    futures = {
+        pool.submit(contextvars.copy_context().run, fn, *args): name
+        for name, (fn, args) in branches.items()
+    }
+    done, pending = wait(futures, timeout=deadline_ms / 1000.0 if deadline_ms > 0 else None)
+
+    for f in done:
+        collect(futures[f], f.result)
+    # A late branch that never started is cancelled; one already running can't
+    # be interrupted, so it finishes in the pool and its result is dropped
+    for f in pending:
+        f.cancel()
+    timed_out = sorted(futures[f] for f in pending)
+    if timed_out:
+        logging.warning(f"Retrieval deadline of {deadline_ms:.0f} ms missed by {', '.join(timed_out)}.")
+    return sources, timed_out, sorted(errors)
+
+
+def _bm25_hits(
+    snapshot: IndexSnapshot,
+    query: str,
+    limit: int,
+    doc_id: Optional[int]
+) -> List[Tuple[int, float]]:
+    # Search errors propagate: _run_branches reports them and keeps the result out of the cache
+    ix = snapshot.ix
+    hits_out: List[Tuple[int, float]] = []
+    if not ix:
+        return hits_out
+    raw_q = (query or "").strip()
+    if not raw_q:
+        logging.info("Empty query; skipping BM25.")
+        return hits_out
+    parser = MultifieldParser(["text"], schema=ix.schema, group=OrGroup.factory(0.9))
+    q = parser.parse(raw_q)
+    if str(q).strip() in ("", "()", "[]"):
+        return hits_out
+    doc_filter = Term("document_id", doc_id) if doc_id is not None else None
+    with span("bm25"), ix.searcher(weighting=scoring.BM25F()) as searcher:
+        hits = searcher.search(q, limit=limit, filter=doc_filter)
+        for hit in hits:
+            cid_val = hit.get("chunk_id") or hit.get("id") or hit.get("pk")
+            try:
+                cid = int(cid_val)
+            except Exception:
+                continue
+            hits_out.append((cid, float(hit.score)))
+    return hits_out
+
+
+def _vector_hits(
+    snapshot: IndexSnapshot,
+    query: str,
+    limit: int,
+    doc_id: Optional[int],
+    nprobe: Optional[int],
+    ef_search: Optional[int]
+) -> List[Tuple[int, float]]:
+    # Indexes are IndexIDMap2, so search returns chunk ids directly; only a
+    # legacy global index still needs its row -> chunk id array
+    dead = frozenset()
+    row_ids = None
+    deltas = ()
+    if doc_id is None:
+        faiss_index = snapshot.faiss_index
+        row_ids = snapshot.row_ids
+        dead = snapshot.tombstones
+        deltas = snapshot.faiss_deltas
+    else:
+        faiss_index = snapshot.doc_index(doc_id)
+
+    hits_out: List[Tuple[int, float]] = []
+    if faiss_index is None:
+        return hits_out
+    q_emb = get_query_embedding(query)
+    q_emb = q_emb / (np.linalg.norm(q_emb, axis=1, keepdims=True) + 1e-12)
+    params = faiss_search_params(faiss_index, nprobe, ef_search)
+    # Over-fetch so tombstoned hits don't eat into the `limit` live ones
+    k = limit + min(len(dead), limit)
+    found: List[Tuple[int, float]] = []
+    with span("faiss"):
+        D, I = faiss_index.search(q_emb, k, params=params)
+        for idx, sim in zip(I[0], D[0]):
+            cid = int(idx)
+            if row_ids is not None and idx >= 0:
+                cid = int(row_ids[idx]) if idx < len(row_ids) else -1
+            found.append((cid, float(sim)))
+        # Recently appended vectors, exact search over each delta file
+        for delta in deltas:
+            D, I = delta.search(q_emb, k)
+            found.extend((int(idx), float(sim)) for idx, sim in zip(I[0], D[0]))
+    if deltas:
+        found.sort(key=lambda hit: hit[1], reverse=True)
+    # Inner product over normalized vectors: cosine similarity, higher is better
+    seen = set()
+    for cid, sim in found:
+        if cid < 0 or cid in dead or cid in seen:
+            continue
+        seen.add(cid)
+        hits_out.append((cid, sim))
+        if len(hits_out) >= limit:
+            break
+    return hits_out
@@ -1,14 +1,26 @@
 # app/routes.py
 
-from flask import Blueprint, request, jsonify, current_app, send_file, send_from_directory
+from flask import Blueprint, Response, request, jsonify, current_app, send_file, send_from_directory, stream_with_context
 from .utils import save_upload, delete_document
 from .ingestion import extract_and_chunk
-from .indexer import build_indexes
+from .indexer import build_indexes, compact_indexes, COMPACT_TOMBSTONE_RATIO
 from .models import Chunk, Document
 from .retriever import retrieve
-from .generator import generate_answer
+from .generator import generate_answer, stream_answer, cited_ids, pack_prompt, answer_mode, ANSWER_MODES
+from .registry import registry
+from .metrics import metrics, span, start_timings
+from . import answer_cache, jobs
 
 import os
+import json
+import time
+
+from typing import Optional
+
+from redis.exceptions import LockError
+
+INGEST_ASYNC = os.getenv("INGEST_ASYNC", "1") not in ("0", "false", "False")
+USE_RERANKER = os.getenv("USE_RERANKER", "1") not in ("0", "false", "False")
 
 api = Blueprint("api", __name__)
 
@@ -16,6 +28,14 @@ def error(msg: str, code: int = 400):
     return jsonify({"error": msg}), code
 
 
+def _wants_timings() -> bool:
+    """Per-stage timings are opt-in: `?timings=1`, or `"timings": true` in a JSON body."""
+    flag = request.args.get("timings") or request.form.get("timings")
+    if flag is None and request.is_json:
+        flag = (request.get_json(silent=True) or {}).get("timings")
+    return str(flag).lower() in ("1", "true")
+
+
 @api.route("/upload", methods=["POST"])
 def upload():
     file = request.files.get("file")
@@ -23,16 +43,80 @@ def upload():
         return error("Missing or invalid PDF file.")
 
     name = request.form.get("doc_name") or file.filename
+    timings = start_timings() if _wants_timings() else None
     doc_id, path = save_upload(file, name)
 
-    count = extract_and_chunk(doc_id, path)
-    build_indexes(reindex_all=False)
+    if INGEST_ASYNC:
+        job_id = jobs.enqueue("ingest", doc_id=doc_id, path=path)
+        return jsonify({
+            "doc_id": doc_id,
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}",
+            "message": "Upload accepted, processing in the background."
+        }), 202
 
-    return jsonify({
+    with span("ingest"):
+        count = extract_and_chunk(doc_id, path)
+    try:
+        with jobs.index_lock(blocking_timeout=jobs.INDEX_LOCK_WAIT), span("index_build"):
+            unembedded = build_indexes(reindex_all=False, doc_id=doc_id)
+    except LockError:
+        # A rebuild or compaction holds the indexes; don't tie up this worker for it
+        job_id = jobs.enqueue("index", doc_id=doc_id)
+        return jsonify({
+            "doc_id": doc_id,
+            "chunks": count,
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}",
+            "message": f"{count} chunks created; indexing queued behind a running index job."
+        }), 202
+
+    body = {
         "doc_id": doc_id,
         "chunks": count,
         "message": f"Upload successful, {count} chunks created."
-    }), 201
+    }
+    if unembedded:
+        # Left out of the indexes until an index run manages to embed them
+        body["unembedded"] = unembedded
+        body["message"] += f" {unembedded} could not be embedded yet and are not searchable."
+    if timings is not None:
+        body["timings"] = timings
+    return jsonify(body), 201
+
+
+@api.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    status = jobs.get_status(job_id)
+    if status is None:
+        return error(f"Job {job_id} not found.", 404)
+    return jsonify(status), 200
+
+
+@api.route("/reindex", methods=["POST"])
+def reindex():
+    job_id = jobs.enqueue("reindex")
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "message": "Full reindex queued."
+    }), 202
+
+
+@api.route("/stats", methods=["GET"])
+def stats():
+    from .embedder import query_batcher
+    from .generator import generation_batcher
+    return jsonify({
+        "query_embedding_batcher": query_batcher.stats(),
+        "generation_batcher": generation_batcher.stats(),
+        "startup": registry.timings(),
+    }), 200
+
+
+@api.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @api.route("/chunks/<int:doc_id>", methods=["GET"])
@@ -53,7 +137,18 @@ def list_chunks(doc_id):
 @api.route("/delete/<int:doc_id>", methods=["DELETE"])
 def delete_doc(doc_id):
     try:
-        delete_document(doc_id)
+        ratio = delete_document(doc_id)
+        if ratio is None:
+            return jsonify({ "message": f"Document {doc_id} deleted; index cleanup queued." }), 202
+        if ratio >= COMPACT_TOMBSTONE_RATIO:
+            if INGEST_ASYNC:
+                jobs.enqueue("compact")
+            else:
+                try:
+                    with jobs.index_lock(timeout=jobs.REINDEX_LOCK_TIMEOUT, blocking_timeout=jobs.INDEX_LOCK_WAIT):
+                        compact_indexes()
+                except LockError:
+                    jobs.enqueue("compact")
         return jsonify({ "message": f"Document {doc_id} deleted." }), 200
     except ValueError as e:
         return jsonify({ "error": str(e) }), 404
@@ -62,60 +157,218 @@ def delete_doc(doc_id):
         return jsonify({ "error": "Server error during deletion." }), 500
 
 
-@api.route("/query", methods=["POST"])
-def query():
+def _query_args():
+    """
+    Validate the JSON body of /query; returns (doc_id, question, mode, error
+    response). `mode` is an optional "generative" or "extractive".
+    """
     data = request.get_json(force=True)
     doc_id  = data.get("doc_id")
     question = (data.get("question") or "").strip()
+    mode = data.get("mode")
     if not doc_id or not question:
-        return error("Both doc_id and question are required.")
+        return None, None, None, error("Both doc_id and question are required.")
+    try:
+        doc_id = int(doc_id)
+    except (TypeError, ValueError):
+        return None, None, None, error("doc_id must be an integer.")
+    if mode is not None and mode not in ANSWER_MODES:
+        return None, None, None, error(f"mode must be one of: {', '.join(ANSWER_MODES)}.")
 
-    all_chunks = Chunk.query.filter_by(document_id=doc_id).all()
-    if not all_chunks:
-        return error(f"No document #{doc_id} found.", 404)
+    if Chunk.query.filter_by(document_id=doc_id).first() is None:
+        return None, None, None, error(f"No document #{doc_id} found.", 404)
+    return doc_id, question, mode, None
 
-    # ce = current_app.cross_encoder
-    ce = None
 
-    hits = retrieve(
-        question,
-        top_k_bm25=5,
-        top_k_faiss=5,
-        top_n=5,
-        cross_encoder=ce
-    )
-    hit_ids = [cid for cid, _ in hits] if hits else []
+def _context_chunks(question: str, doc_id: int):
+    """Retrieve the chunks to answer from; returns (hits, chunks, retrieval details)."""
+    ce = registry.get("cross_encoder") if USE_RERANKER else None
 
-    # Pull only chunks for THIS doc, preserving the hit order
-    if hit_ids:
-        doc_chunks = (
-            Chunk.query
-                 .filter(Chunk.id.in_(hit_ids), Chunk.document_id == doc_id)
-                 .all()
-        )
-        by_id = {c.id: c for c in doc_chunks}
-        top_chunks = [by_id[cid] for cid in hit_ids if cid in by_id]
-    else:
-        top_chunks = []
-
-    # Fallback: if retrieval produced nothing for this doc, use the first few chunks
-    if not top_chunks:
-        top_chunks = (
-            Chunk.query
-                 .filter_by(document_id=doc_id)
-                 .order_by(Chunk.page_number.asc(), Chunk.chunk_index.asc())
-                 .limit(5)
-                 .all()
+    details = {}
+    with span("retrieve"):
+        hits = retrieve(
+            question,
+            top_n=5,
+            cross_encoder=ce,
+            doc_id=doc_id,
+            details=details
         )
+    hit_ids = [cid for cid, _ in hits] if hits else []
 
-    answer_text, cited_chunk_ids = generate_answer(question, top_chunks)
+    with span("fetch_chunks"):
+        # Pull only chunks for THIS doc, preserving the hit order
+        if hit_ids:
+            doc_chunks = (
+                Chunk.query
+                     .filter(Chunk.id.in_(hit_ids), Chunk.document_id == doc_id)
+                     .all()
+            )
+            by_id = {c.id: c for c in doc_chunks}
+            top_chunks = [by_id[cid] for cid in hit_ids if cid in by_id]
+        else:
+            top_chunks = []
 
-    return jsonify({
+        # Fallback: if retrieval produced nothing for this doc, use the first few chunks
+        if not top_chunks:
+            top_chunks = (
+                Chunk.query
+                     .filter_by(document_id=doc_id)
+                     .order_by(Chunk.page_number.asc(), Chunk.chunk_index.asc())
+                     .limit(5)
+                     .all()
+            )
+    return hits, top_chunks, details
+
+
+def _cached_answer(doc_id: int, question: str, mode: str):
+    """(cached /query body or None, cache epoch) for the answer cache."""
+    with span("answer_cache"):
+        return answer_cache.lookup(doc_id, question, mode)
+
+
+def _cache_answer(doc_id: int, question: str, wanted: str, used: Optional[str], epoch, body: dict):
+    # Shed, failed-over or partial-retrieval answers would outlive the load that caused them
+    if used != wanted or body["timed_out"] or body["errors"]:
+        return
+    answer_cache.store(doc_id, question, wanted, epoch, {
+        k: body[k] for k in ("answer", "citations", "used_k", "context_count", "sources")
+    })
+
+
+@api.route("/query", methods=["POST"])
+def query():
+    doc_id, question, mode, err = _query_args()
+    if err:
+        return err
+
+    timings = start_timings() if _wants_timings() else None
+    # The mode asked for keys the cache, so a shed request can still get a cached generative answer
+    wanted = answer_mode(mode, shed=False)
+    cached, epoch = _cached_answer(doc_id, question, wanted)
+    if cached is not None:
+        body = dict(cached, timed_out=[], errors=[], cached=True)
+        if timings is not None:
+            body["timings"] = timings
+        return jsonify(body), 200
+
+    hits, top_chunks, details = _context_chunks(question, doc_id)
+    # Decided once here, shedding included; the generator reports any fallback in `generated`
+    generated = {}
+    with span("generate"):
+        answer_text, cited_chunk_ids = generate_answer(question, top_chunks, answer_mode(mode), generated)
+
+    body = {
         "answer":      answer_text,
         "citations":   cited_chunk_ids,
         "used_k":      len(hits or []),
-        "context_count": len(top_chunks)
-    }), 200
+        "context_count": len(top_chunks),
+        "sources":     details.get("sources", []),
+        "timed_out":   details.get("timed_out", []),
+        "errors":      details.get("errors", []),
+        "cached":      False
+    }
+    _cache_answer(doc_id, question, wanted, generated.get("mode"), epoch, body)
+    if timings is not None:
+        body["timings"] = timings
+    return jsonify(body), 200
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@api.route("/query/stream", methods=["POST"])
+def query_stream():
+    """
+    Same request as /query, answered as Server-Sent Events: one `citations`
+    event as soon as retrieval is done, a `token` event per decoded piece,
+    then `done` with the full answer (or `error`). With timings requested,
+    `done` also carries them, including `first_token`. A cached answer
+    arrives as a single `token` event. If generation falls back to the
+    extractive answer, a second `citations` event replaces the first.
+    """
+    doc_id, question, mode, err = _query_args()
+    if err:
+        return err
+
+    timings = start_timings() if _wants_timings() else None
+    wanted = answer_mode(mode, shed=False)
+    cached, epoch = _cached_answer(doc_id, question, wanted)
+    if cached is not None:
+        return _stream_cached(cached, timings)
+
+    hits, top_chunks, details = _context_chunks(question, doc_id)
+    used = answer_mode(mode)
+    generated = {}
+    # Packed once: its chunk ids are cited up front, its token ids generated from
+    packed = pack_prompt(question, top_chunks) if used == "generative" else None
+    summary = {
+        "citations": packed.chunk_ids if packed is not None else cited_ids(top_chunks),
+        "used_k": len(hits or []),
+        "context_count": len(top_chunks),
+        "sources": details.get("sources", []),
+        "timed_out": details.get("timed_out", []),
+        "errors": details.get("errors", []),
+    }
+
+    def events():
+        yield _sse("citations", dict(summary, cached=False))
+        # The body streams after the view returns, so stages are recorded here
+        # rather than through span()
+        def record(stage: str, seconds: float):
+            metrics.observe("stage_seconds", seconds, stage=stage)
+            if timings is not None:
+                timings[stage] = round(seconds * 1000.0, 3)
+
+        pieces = []
+        started = time.perf_counter()
+        try:
+            for piece in stream_answer(question, top_chunks, used, generated, packed):
+                if not pieces:
+                    record("first_token", time.perf_counter() - started)
+                    if generated.get("mode") != used:
+                        # Fell back to the extractive answer, which cites every top chunk
+                        summary["citations"] = cited_ids(top_chunks)
+                        yield _sse("citations", dict(summary, cached=False))
+                pieces.append(piece)
+                yield _sse("token", {"text": piece})
+        except Exception as e:
+            current_app.logger.error("Streaming answer failed: %s", e)
+            yield _sse("error", {"error": "Server error while generating the answer."})
+            return
+        record("generate", time.perf_counter() - started)
+        done = {"answer": "".join(pieces).strip()}
+        _cache_answer(doc_id, question, wanted, generated.get("mode"), epoch, dict(summary, answer=done["answer"]))
+        if timings is not None:
+            done["timings"] = timings
+        yield _sse("done", done)
+
+    return _event_stream(events())
+
+
+def _stream_cached(cached: dict, timings):
+    def events():
+        yield _sse("citations", {
+            **{k: cached[k] for k in ("citations", "used_k", "context_count", "sources")},
+            "timed_out": [],
+            "errors": [],
+            "cached": True,
+        })
+        yield _sse("token", {"text": cached["answer"]})
+        done = {"answer": cached["answer"]}
+        if timings is not None:
+            done["timings"] = timings
+        yield _sse("done", done)
+
+    return _event_stream(events())
+
+
+def _event_stream(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @api.route("/upload/<int:doc_id>", methods=["GET"])
@@ -0,0 +1,254 @@
+# app/sentence_index.py
+
+import os
+import re
+import zlib
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .chunker import split_sentences
+
+# Configuration from environment
+# Defaults under the index root, like INDEX_MANIFEST
+_INDEX_ROOT = os.path.dirname(os.getenv("FAISS_INDEX_DIR", "indexes/faiss_index").rstrip("/")) or "."
+SENTENCE_INDEX_DIR = os.getenv("SENTENCE_INDEX_DIR", os.path.join(_INDEX_ROOT, "sentences"))
+SENTENCE_INDEX_CACHE_SIZE = int(os.getenv("SENTENCE_INDEX_CACHE_SIZE", "64"))
+# "bm25" scores hashed terms; "embedding" also stores sentence vectors at ingestion
+EXTRACTIVE_SCORING = os.getenv("EXTRACTIVE_SCORING", "bm25").lower()
+EXTRACTIVE_SENTENCES = int(os.getenv("EXTRACTIVE_SENTENCES", "5"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _hash_terms(text: str) -> np.ndarray:
+    return np.array([zlib.crc32(t.encode("utf-8")) for t in _TOKEN_RE.findall(text.lower())], dtype=np.uint32)
+
+
+def index_path(doc_id: int) -> str:
+    return os.path.join(SENTENCE_INDEX_DIR, f"{doc_id}.npz")
+
+
+class SentenceIndexBuilder:
+    """
+    Collects one document's sentences during ingestion. Each sentence is
+    split and tokenized once; terms are stored as crc32 hashes in CSR form
+    (one row per sentence) next to the sentence text and its chunk id.
+    """
+
+    def __init__(self, doc_id: int):
+        self.doc_id = doc_id
+        self.chunk_ids: List[int] = []
+        self.sentences: List[str] = []
+
+    def add(self, chunk_id: int, text: str):
+        for sentence in split_sentences(text or ""):
+            self.chunk_ids.append(chunk_id)
+            self.sentences.append(sentence)
+
+    def save(self) -> Optional[str]:
+        if not self.sentences:
+            return None
+
+        terms, tfs, indptr, lengths = [], [], [0], []
+        for sentence in self.sentences:
+            hashed = _hash_terms(sentence)
+            uniq, counts = np.unique(hashed, return_counts=True)
+            terms.append(uniq)
+            tfs.append(counts.astype(np.uint16))
+            indptr.append(indptr[-1] + len(uniq))
+            lengths.append(len(hashed))
+
+        blob = "\n".join(s.replace("\n", " ") for s in self.sentences).encode("utf-8")
+        arrays = {
+            "chunk_ids": np.asarray(self.chunk_ids, dtype=np.int64),
+            "text": np.frombuffer(blob, dtype=np.uint8),
+            "indptr": np.asarray(indptr, dtype=np.int64),
+            "terms": np.concatenate(terms),
+            "tf": np.concatenate(tfs),
+            "lengths": np.asarray(lengths, dtype=np.float32),
+        }
+        if EXTRACTIVE_SCORING == "embedding":
+            from .embedder import EMBED_BATCH_SIZE, _encode_batch
+
+            # Straight to the encoder: sentences would flood the Redis embedding cache
+            embs = np.concatenate([
+                _encode_batch(self.sentences[i:i + EMBED_BATCH_SIZE])
+                for i in range(0, len(self.sentences), EMBED_BATCH_SIZE)
+            ])
+            embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-12)
+            arrays["embeddings"] = embs.astype(np.float16)
+
+        os.makedirs(SENTENCE_INDEX_DIR, exist_ok=True)
+        path = index_path(self.doc_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        logging.info(f"Sentence index for document {self.doc_id}: {len(self.sentences)} sentences.")
+        return path
+
+
+class SentenceIndex:
+    """One document's sentences, loaded for vectorized scoring."""
+
+    def __init__(self, arrays):
+        self.chunk_ids = arrays["chunk_ids"]
+        self.sentences = bytes(arrays["text"]).decode("utf-8").split("\n")
+        self.indptr = arrays["indptr"]
+        self.terms = arrays["terms"]
+        self.tf = arrays["tf"].astype(np.float32)
+        lengths = arrays["lengths"]
+        self.norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()), 1.0))
+        self.vocab, self.df = np.unique(self.terms, return_counts=True)
+        self.embeddings = arrays["embeddings"] if "embeddings" in arrays.files else None
+
+        # A chunk's sentences are contiguous rows: chunk id -> (first, end)
+        cuts = np.flatnonzero(np.diff(self.chunk_ids)) + 1
+        starts = np.concatenate(([0], cuts))
+        ends = np.concatenate((cuts, [len(self.chunk_ids)]))
+        self.chunk_rows = dict(zip(self.chunk_ids[starts].tolist(), zip(starts.tolist(), ends.tolist())))
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def rows_of(self, chunk_ids: Iterable[int]) -> np.ndarray:
+        spans = [self.chunk_rows[cid] for cid in chunk_ids if cid in self.chunk_rows]
+        if not spans:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(first, end) for first, end in spans])
+
+    def bm25(self, question: str, rows: np.ndarray) -> np.ndarray:
+        """BM25 of `rows` against the question, with document-wide idf."""
+        scores = np.zeros(len(rows), dtype=np.float32)
+        q_terms = np.unique(_hash_terms(question))
+        if len(q_terms) == 0 or len(rows) == 0:
+            return scores
+
+        # Gather the rows' postings in one pass: local row number and posting position
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        local = np.repeat(np.arange(len(rows)), counts)
+        postings = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+
+        terms = self.terms[postings]
+        hit = np.isin(terms, q_terms)
+        if not hit.any():
+            return scores
+        df = self.df[np.searchsorted(self.vocab, terms[hit])]
+        idf = np.log1p((len(self) - df + 0.5) / (df + 0.5))
+        tf = self.tf[postings[hit]]
+        local = local[hit]
+        contrib = idf * tf * (BM25_K1 + 1) / (tf + self.norm[rows[local]])
+        return np.bincount(local, weights=contrib, minlength=len(rows)).astype(np.float32)
+
+    def cosine(self, query_embedding: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        q = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        return self.embeddings[rows].astype(np.float32) @ q
+
+    def best(self, question: str, chunk_ids: Iterable[int], k: int = EXTRACTIVE_SENTENCES) -> List[str]:
+        """Top `k` sentences of `chunk_ids` for `question`, best first; [] if nothing matches."""
+        rows = self.rows_of(chunk_ids)
+        if len(rows) == 0:
+            return []
+        if EXTRACTIVE_SCORING == "embedding" and self.embeddings is not None:
+            from .embedder import get_query_embedding
+            scores = self.cosine(get_query_embedding(question), rows)
+        else:
+            scores = self.bm25(question, rows)
+            rows, scores = rows[scores > 0], scores[scores > 0]
+        if len(rows) == 0:
+            return []
+
+        top = np.arange(len(rows))
+        if len(top) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        # Best first; ties keep document order
+        top = top[np.lexsort((rows[top], -scores[top]))]
+        return [self.sentences[i] for i in rows[top]]
+
+
+_cache: "OrderedDict[int, SentenceIndex]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def build_sentence_index(doc_id: int) -> Optional[str]:
+    """(Re)build a document's sentence index from its chunks in the database."""
+    from .models import Chunk
+    from . import db
+
+    builder = SentenceIndexBuilder(doc_id)
+    rows = (
+        db.session.query(Chunk.id, Chunk.text)
+          .filter(Chunk.document_id == doc_id)
+          .order_by(Chunk.page_number, Chunk.chunk_index)
+          .yield_per(1000)
+    )
+    for chunk_id, text in rows:
+        builder.add(chunk_id, text)
+    forget(doc_id)
+    return builder.save()
+
+
+def load(doc_id: int) -> Optional[SentenceIndex]:
+    """
+    The document's sentence index from a small LRU. Documents ingested
+    before sentence indexes existed get theirs built on first use.
+    """
+    with _cache_lock:
+        if doc_id in _cache:
+            _cache.move_to_end(doc_id)
+            return _cache[doc_id]
+
+    path = index_path(doc_id)
+    try:
+        if not os.path.exists(path) and not build_sentence_index(doc_id):
+            return None
+        with np.load(path) as arrays:
+            index = SentenceIndex(arrays)
+    except Exception as e:
+        logging.exception(f"Failed to load sentence index {path}: {e}")
+        return None
+
+    with _cache_lock:
+        _cache[doc_id] = index
+        while len(_cache) > SENTENCE_INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def forget(doc_id: int):
+    with _cache_lock:
+        _cache.pop(doc_id, None)
+
+
+def remove_sentence_index(doc_id: int):
+    forget(doc_id)
+    path = index_path(doc_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def best_sentences(question: str, chunks: List, k: int = EXTRACTIVE_SENTENCES) -> Optional[List[str]]:
+    """
+    Best sentences of `chunks` for `question`, or None when no sentence
+    index is available and the caller should fall back.
+    """
+    by_doc: Dict[int, List[int]] = OrderedDict()
+    for c in chunks:
+        by_doc.setdefault(int(c.document_id), []).append(int(c.id))
+
+    ranked = []
+    for doc_id, chunk_ids in by_doc.items():
+        index = load(doc_id)
+        if index is None:
+            return None
+        ranked.extend(index.best(question, chunk_ids, k))
+    return ranked[:k]
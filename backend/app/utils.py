@@ -2,9 +2,11 @@
 
 import os
 
+from typing import Optional
 from flask import current_app
+from redis.exceptions import LockError
 from werkzeug.utils import secure_filename
-from .models import Document
+from .models import Chunk, Document
 from . import db
 
 def save_upload(file, name):
@@ -22,7 +24,17 @@ def save_upload(file, name):
     return doc.id, full_path
 
 
-def delete_document(doc_id: int):
+def delete_document(doc_id: int) -> Optional[float]:
+    """
+    Delete the PDF, the DB rows and the document's index entries. Returns
+    the global index's tombstone ratio so the caller can schedule compaction,
+    or None when the index lock was busy and the index-side removal was
+    queued as a job instead.
+    """
+    from .indexer import remove_document
+    from .sentence_index import remove_sentence_index
+    from . import jobs
+
     doc = Document.query.get(doc_id)
     if not doc:
         raise ValueError(f"Document {doc_id} not found")
@@ -32,5 +44,14 @@ def delete_document(doc_id: int):
     if os.path.exists(file_path):
         os.remove(file_path)
 
+    chunk_ids = [cid for (cid,) in db.session.query(Chunk.id).filter(Chunk.document_id == doc_id)]
     db.session.delete(doc)
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+    remove_sentence_index(doc_id)
+
+    try:
+        with jobs.index_lock(blocking_timeout=jobs.INDEX_LOCK_WAIT):
+            return remove_document(doc_id, chunk_ids)
+    except LockError:
+        jobs.enqueue("remove", doc_id=doc_id, chunk_ids=chunk_ids)
+        return None
\ No newline at end of file
@@ -0,0 +1,197 @@
+# app/vector_store.py
+
+import os
+import json
+import logging
+
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from .metrics import metrics
+
+# Configuration from environment
+# Defaults to the directory holding the FAISS index and the manifest
+_INDEX_ROOT = os.path.dirname(os.getenv("FAISS_INDEX_DIR", "indexes/faiss_index").rstrip("/")) or "."
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", os.path.join(_INDEX_ROOT, "vectors"))
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16").lower()
+VECTOR_STORE_BATCH = int(os.getenv("VECTOR_STORE_BATCH", "8192"))
+
+_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+def _unit(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12)
+
+
+class VectorStore:
+    """
+    Append-only, memory-mapped matrix of unit-normalized chunk embeddings.
+
+    Rows live in flat files (vectors, chunk ids, document ids and, for int8,
+    one scale per row); meta.json holds the row count and is replaced only
+    after the rows are on disk, so readers never see a partial append. Every
+    process maps the same files read-only and shares the page cache.
+    """
+
+    def __init__(self, path: str, dtype: str = VECTOR_STORE_DTYPE):
+        self.path = path
+        self.default_dtype = dtype
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unknown VECTOR_STORE_DTYPE: {dtype}")
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def meta(self) -> dict:
+        try:
+            with open(self._file("meta.json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"count": 0, "dim": 0, "dtype": self.default_dtype}
+
+    def _write_meta(self, meta: dict):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def __len__(self) -> int:
+        return int(self.meta()["count"])
+
+    def _map(self, name: str, dtype, shape: tuple) -> np.ndarray:
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    def _views(self, meta: dict):
+        n, dim = int(meta["count"]), int(meta["dim"])
+        dtype = _DTYPES[meta["dtype"]]
+        ids = self._map("ids.i64", np.int64, (n,))
+        docs = self._map("docs.i64", np.int64, (n,))
+        vecs = self._map("vectors.bin", dtype, (n, dim))
+        scales = self._map("scales.f32", np.float32, (n,)) if meta["dtype"] == "int8" else None
+        return ids, docs, vecs, scales
+
+    def ids(self) -> np.ndarray:
+        return self._views(self.meta())[0]
+
+    def doc_ids(self) -> np.ndarray:
+        return self._views(self.meta())[1]
+
+    @staticmethod
+    def _decode(vecs: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+        out = np.asarray(vecs, dtype=np.float32)
+        if scales is not None:
+            out = out * np.asarray(scales, dtype=np.float32)[:, None]
+        return _unit(out)
+
+    def iter_batches(self, batch_size: int = VECTOR_STORE_BATCH) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield (chunk ids, document ids, float32 unit vectors) in row order."""
+        ids, docs, vecs, scales = self._views(self.meta())
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            yield (
+                np.array(ids[start:end]),
+                np.array(docs[start:end]),
+                self._decode(vecs[start:end], None if scales is None else scales[start:end]),
+            )
+
+    def sample(self, n: int, seed: int = 0) -> np.ndarray:
+        """Up to `n` random rows as float32 unit vectors, e.g. to train an index."""
+        ids, _, vecs, scales = self._views(self.meta())
+        rows = np.arange(len(ids))
+        if len(rows) > n:
+            rows = np.sort(np.random.default_rng(seed).choice(len(rows), n, replace=False))
+        return self._decode(vecs[rows], None if scales is None else scales[rows])
+
+    def _encode(self, unit: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if dtype == "int8":
+            scales = np.abs(unit).max(axis=1) / 127.0 + 1e-12
+            return np.round(unit / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return unit.astype(np.float16), None
+
+    def append(self, chunk_ids, doc_ids, embeddings: np.ndarray) -> int:
+        """Append rows for chunks not stored yet; returns how many were added."""
+        meta = self.meta()
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if len(chunk_ids) == 0:
+            return 0
+
+        fresh = ~np.isin(chunk_ids, self._views(meta)[0]) if meta["count"] else np.ones(len(chunk_ids), bool)
+        if not fresh.any():
+            return 0
+        unit = _unit(embeddings[fresh])
+        if meta["dim"] and unit.shape[1] != meta["dim"]:
+            raise ValueError(f"Vector store holds dim {meta['dim']}, got {unit.shape[1]}")
+
+        os.makedirs(self.path, exist_ok=True)
+        n = int(meta["count"])
+        vecs, scales = self._encode(unit, meta["dtype"])
+        parts = [("ids.i64", chunk_ids[fresh]), ("docs.i64", doc_ids[fresh]), ("vectors.bin", vecs)]
+        if scales is not None:
+            parts.append(("scales.f32", scales))
+
+        for name, arr in parts:
+            path = self._file(name)
+            row_bytes = arr.itemsize * (arr.shape[1] if arr.ndim > 1 else 1)
+            with open(path, "ab") as f:
+                # Drop rows a crashed append left behind the committed count
+                f.truncate(n * row_bytes)
+                f.write(np.ascontiguousarray(arr).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._write_meta({"count": n + len(vecs), "dim": unit.shape[1], "dtype": meta["dtype"]})
+        return len(vecs)
+
+    def compact(self, keep: np.ndarray, batch_size: int = VECTOR_STORE_BATCH) -> int:
+        """Rewrite the store with only the rows whose chunk id is in `keep`; returns rows kept."""
+        meta = self.meta()
+        views = self._views(meta)
+        names = ["ids.i64", "docs.i64", "vectors.bin"]
+        if views[3] is not None:
+            names.append("scales.f32")
+        ids = views[0]
+
+        kept = 0
+        files = {name: open(self._file(name + ".tmp"), "wb") for name in names}
+        try:
+            for start in range(0, len(ids), batch_size):
+                mask = np.isin(ids[start:start + batch_size], keep)
+                kept += int(mask.sum())
+                for name, view in zip(names, views):
+                    files[name].write(np.ascontiguousarray(view[start:start + batch_size][mask]).tobytes())
+        finally:
+            for f in files.values():
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+
+        # Shrinking the count first keeps readers inside the rows being replaced
+        self._write_meta({**meta, "count": 0})
+        for name in names:
+            os.replace(self._file(name + ".tmp"), self._file(name))
+        self._write_meta({**meta, "count": kept})
+        logging.info(f"Vector store compacted from {len(ids)} to {kept} rows.")
+        return kept
+
+    def reset(self, dtype: Optional[str] = None):
+        """Drop every row; the next append starts a store of `dtype`."""
+        dtype = dtype or self.default_dtype
+        os.makedirs(self.path, exist_ok=True)
+        self._write_meta({"count": 0, "dim": 0, "dtype": dtype})
+        for name in ("ids.i64", "docs.i64", "vectors.bin", "scales.f32"):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        logging.info(f"Vector store at {self.path} reset ({dtype}).")
+
+
+vector_store = VectorStore(VECTOR_STORE_DIR)
+
+
+@metrics.collector
+def _store_gauges(m):
+    m.set("vector_store_rows", len(vector_store))
@@ -0,0 +1,153 @@
+# bench/ann_report.py
+"""
+Recall-versus-latency report for the FAISS index modes.
+
+Every configured mode is built on the same vectors and compared against the
+exact IndexFlatIP baseline over a set of held-out queries.
+
+    python -m bench.ann_report                    # vectors from chunks.embedding
+    python -m bench.ann_report --synthetic 100000 # random vectors, no DB needed
+
+Below FAISS_MIN_ANN_SIZE the indexer builds a flat index whatever the mode,
+so the ANN rows are skipped there unless --force-ann builds them anyway.
+"""
+
+import sys
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from app import indexer
+from app.indexer import create_faiss_index, _normalize
+from app.retriever import faiss_search_params
+
+
+def _load_db_embeddings(limit: int) -> np.ndarray:
+    from app import create_app, db
+    from app.models import Chunk
+
+    app = create_app()
+    with app.app_context():
+        q = db.session.query(Chunk.embedding).filter(Chunk.embedding.isnot(None))
+        if limit:
+            q = q.limit(limit)
+        blobs = [row[0] for row in q.yield_per(1000)]
+    if not blobs:
+        raise SystemExit("No chunk embeddings in the database.")
+    return np.stack([np.frombuffer(b, dtype=np.float32) for b in blobs])
+
+
+def _synthetic_embeddings(n: int, dim: int) -> np.ndarray:
+    # Clustered data; uniform random vectors make every ANN index look bad
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), n)
+    return centers[labels] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _search(index: faiss.Index, queries: np.ndarray, k: int, params) -> tuple:
+    latencies = []
+    found = []
+    for q in queries:
+        start = time.perf_counter()
+        _, I = index.search(q[None, :], k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        found.append(I[0])
+    return np.array(found), np.array(latencies)
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def run(embeddings: np.ndarray, queries: int, k: int, nprobes, ef_searches, force_ann: bool = False) -> list:
+    embeddings = np.ascontiguousarray(_normalize(embeddings), dtype=np.float32)
+    rng = np.random.default_rng(1)
+    q_rows = rng.choice(len(embeddings), min(queries, len(embeddings)), replace=False)
+    query_vecs = embeddings[q_rows] + 0.05 * rng.standard_normal((len(q_rows), embeddings.shape[1])).astype(np.float32)
+    query_vecs = np.ascontiguousarray(_normalize(query_vecs), dtype=np.float32)
+
+    rows = []
+    baseline = None
+    variants = [("flat", [None])]
+    if force_ann or len(embeddings) >= indexer.FAISS_MIN_ANN_SIZE:
+        variants.append(("hnsw", ef_searches))
+        variants.append(("ivfpq", nprobes))
+    else:
+        print(
+            f"Skipping hnsw and ivfpq: {len(embeddings)} vectors is below FAISS_MIN_ANN_SIZE="
+            f"{indexer.FAISS_MIN_ANN_SIZE}, where the indexer builds a flat index for every mode. "
+            "Pass --force-ann to measure them anyway.",
+            file=sys.stderr,
+        )
+    if force_ann:
+        # create_faiss_index reads the threshold at call time
+        indexer.FAISS_MIN_ANN_SIZE = 0
+
+    for index_type, knobs in variants:
+        start = time.perf_counter()
+        index = create_faiss_index(embeddings, index_type)
+        index.add(embeddings)
+        build_s = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        for knob in knobs:
+            if index_type == "hnsw":
+                params = faiss_search_params(index, ef_search=knob)
+            elif index_type == "ivfpq":
+                params = faiss_search_params(index, nprobe=knob)
+            else:
+                params = None
+            found, lat = _search(index, query_vecs, k, params)
+            if baseline is None:
+                baseline = found
+            rows.append({
+                "index": type(index).__name__,
+                "mode": index_type,
+                "knob": knob,
+                "build_s": round(build_s, 3),
+                "size_mb": round(size_mb, 2),
+                f"recall@{k}": round(_recall(found, baseline), 4),
+                "p50_ms": round(float(np.percentile(lat, 50)), 3),
+                "p95_ms": round(float(np.percentile(lat, 95)), 3),
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random vectors instead of the DB")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--limit", type=int, default=0, help="max DB embeddings to load")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--force-ann", action="store_true", help="build ANN indexes below FAISS_MIN_ANN_SIZE too")
+    parser.add_argument("--json", help="also write the rows to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        embeddings = _synthetic_embeddings(args.synthetic, args.dim)
+    else:
+        embeddings = _load_db_embeddings(args.limit)
+
+    rows = run(embeddings, args.queries, args.k, args.nprobe, args.ef_search, args.force_ann)
+
+    print(f"{len(embeddings)} vectors, dim={embeddings.shape[1]}, {args.queries} queries")
+    cols = list(rows[0].keys())
+    print("  ".join(f"{c:>14}" for c in cols))
+    for row in rows:
+        print("  ".join(f"{str(row[c]):>14}" for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
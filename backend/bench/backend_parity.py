@@ -0,0 +1,177 @@
+# bench/backend_parity.py
+"""
+Parity and latency of the int8 and ONNX inference backends against fp32.
+
+Each candidate backend is loaded next to the fp32 PyTorch model and run on
+the same inputs:
+
+    embedder       cosine similarity of the embeddings (mean / min)
+    generator      exact-match rate and character similarity of the answers
+    cross-encoder  max score difference and top-1 agreement per question
+
+    python -m bench.backend_parity                       # built-in passages
+    python -m bench.backend_parity --from-db 200 --backends int8
+    python -m bench.backend_parity --min-cosine 0.99      # exit 1 below this
+"""
+
+import argparse
+import difflib
+import json
+import time
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.backends import load_model, quantize
+from app.embedder import EMBED_MODEL, _encode_with
+from app.generator import GENERATION_MODEL, _build_prompt, _clean_answer, _generate_with
+from app.reranker import CROSS_ENCODER_MODEL, RERANK_MAX_LENGTH
+
+SAMPLE_PASSAGES = [
+    "Photosynthesis converts light energy into chemical energy stored in glucose. It takes place in the chloroplasts of plant cells.",
+    "The mitochondria produce ATP through cellular respiration, which consumes oxygen and releases carbon dioxide.",
+    "A binary search tree keeps its keys sorted so that lookup, insertion and deletion take logarithmic time when the tree is balanced.",
+    "Supply and demand determine the market price of a good. When demand rises and supply stays fixed, the price goes up.",
+    "The French Revolution began in 1789 and led to the end of the absolute monarchy in France.",
+    "Newton's second law states that force equals mass times acceleration.",
+    "TCP provides reliable, ordered delivery of a byte stream, while UDP sends independent datagrams without delivery guarantees.",
+    "Enzymes lower the activation energy of chemical reactions without being consumed by them.",
+]
+
+SAMPLE_QUESTIONS = [
+    "Where does photosynthesis happen?",
+    "What does the mitochondria produce?",
+    "How fast is lookup in a balanced binary search tree?",
+    "What happens to price when demand rises?",
+    "When did the French Revolution begin?",
+    "What is Newton's second law?",
+]
+
+
+def _load_db_passages(limit: int) -> list:
+    from app import create_app, db
+    from app.models import Chunk
+
+    app = create_app()
+    with app.app_context():
+        rows = db.session.query(Chunk.text).filter(Chunk.text.isnot(None)).limit(limit).all()
+    return [text for (text,) in rows if text.strip()]
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - start) * 1000.0
+
+
+def embedder_parity(backend: str, passages: list) -> dict:
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(EMBED_MODEL)
+    base = load_model(EMBED_MODEL, "feature-extraction", "torch")
+    cand = load_model(EMBED_MODEL, "feature-extraction", backend)
+    ref, ref_ms = _timed(_encode_with, tokenizer, base, passages)
+    out, out_ms = _timed(_encode_with, tokenizer, cand, passages)
+    ref /= np.linalg.norm(ref, axis=1, keepdims=True)
+    out /= np.linalg.norm(out, axis=1, keepdims=True)
+    cos = (ref * out).sum(axis=1)
+    return {
+        "component": "embedder",
+        "backend": backend,
+        "mean_cosine": round(float(cos.mean()), 5),
+        "min_cosine": round(float(cos.min()), 5),
+        "fp32_ms": round(ref_ms, 1),
+        "backend_ms": round(out_ms, 1),
+    }
+
+
+def generator_parity(backend: str, passages: list, questions: list) -> dict:
+    from transformers import AutoTokenizer
+
+    chunks = [SimpleNamespace(id=i, page_number=1, text=t) for i, t in enumerate(passages)]
+    # Rotate the context so each question sees a different passage first
+    prompts = [_build_prompt(q, chunks[i:] + chunks[:i]) for i, q in enumerate(questions)]
+
+    tokenizer = AutoTokenizer.from_pretrained(GENERATION_MODEL)
+    base = load_model(GENERATION_MODEL, "text2text-generation", "torch")
+    cand = load_model(GENERATION_MODEL, "text2text-generation", backend)
+    ref, ref_ms = _timed(_generate_with, tokenizer, base, prompts)
+    out, out_ms = _timed(_generate_with, tokenizer, cand, prompts)
+    ref = [_clean_answer(a) for a in ref]
+    out = [_clean_answer(a) for a in out]
+    ratios = [difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(ref, out)]
+    return {
+        "component": "generator",
+        "backend": backend,
+        "exact_match": round(sum(a == b for a, b in zip(ref, out)) / len(ref), 3),
+        "mean_text_similarity": round(float(np.mean(ratios)), 4),
+        "fp32_ms": round(ref_ms, 1),
+        "backend_ms": round(out_ms, 1),
+    }
+
+
+def reranker_parity(backend: str, passages: list, questions: list) -> dict:
+    from sentence_transformers import CrossEncoder
+
+    base = CrossEncoder(CROSS_ENCODER_MODEL, max_length=RERANK_MAX_LENGTH)
+    if backend == "onnx":
+        cand = CrossEncoder(CROSS_ENCODER_MODEL, max_length=RERANK_MAX_LENGTH, backend="onnx")
+    else:
+        cand = CrossEncoder(CROSS_ENCODER_MODEL, max_length=RERANK_MAX_LENGTH)
+        quantize(cand.model)
+
+    pairs = [(q, p) for q in questions for p in passages]
+    ref, ref_ms = _timed(lambda: np.asarray(base.predict(pairs, show_progress_bar=False)))
+    out, out_ms = _timed(lambda: np.asarray(cand.predict(pairs, show_progress_bar=False)))
+    ref = ref.reshape(len(questions), len(passages))
+    out = out.reshape(len(questions), len(passages))
+    return {
+        "component": "cross_encoder",
+        "backend": backend,
+        "max_abs_diff": round(float(np.abs(ref - out).max()), 4),
+        "top1_agreement": round(float((ref.argmax(1) == out.argmax(1)).mean()), 3),
+        "fp32_ms": round(ref_ms, 1),
+        "backend_ms": round(out_ms, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["int8", "onnx"], choices=["int8", "onnx"])
+    parser.add_argument("--components", nargs="+", default=["embedder", "generator", "cross_encoder"])
+    parser.add_argument("--from-db", type=int, default=0, help="use the text of N stored chunks as passages")
+    parser.add_argument("--min-cosine", type=float, default=0.0, help="exit 1 if an embedder's min cosine is lower")
+    parser.add_argument("--json", help="also write the rows to this file")
+    args = parser.parse_args()
+
+    passages = _load_db_passages(args.from_db) if args.from_db else SAMPLE_PASSAGES
+    questions = SAMPLE_QUESTIONS
+
+    rows = []
+    for backend in args.backends:
+        for component in args.components:
+            try:
+                if component == "embedder":
+                    rows.append(embedder_parity(backend, passages))
+                elif component == "generator":
+                    rows.append(generator_parity(backend, passages[:8], questions))
+                elif component == "cross_encoder":
+                    rows.append(reranker_parity(backend, passages[:8], questions))
+            except (RuntimeError, ImportError) as e:
+                print(f"skipping {component} on {backend}: {e}")
+
+    for row in rows:
+        print("  ".join(f"{k}={v}" for k, v in row.items()))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+    failed = [r for r in rows if r["component"] == "embedder" and r["min_cosine"] < args.min_cosine]
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# bench/fusion_eval.py
+"""
+Offline evaluation of the retrieval fusion strategies.
+
+Runs every (fusion method, candidate depth) pair over a set of labelled
+questions and reports recall@k, MRR and latency. Labelled questions come from
+a JSONL file, one {"question", "doc_id", "relevant": [chunk ids]} per line,
+or are synthesized from sentences of stored chunks.
+
+    python -m bench.fusion_eval --qrels qrels.jsonl
+    python -m bench.fusion_eval --synthesize 200 --depths 5 10 20
+"""
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from app import create_app, db
+from app.chunker import split_sentences
+from app.fusion import FUSERS
+from app.models import Chunk
+from app.retriever import retrieve
+
+
+def load_qrels(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthesize_qrels(n: int, seed: int = 0) -> list:
+    """Use a random sentence of a random chunk as the question."""
+    rng = random.Random(seed)
+    ids = [cid for (cid,) in db.session.query(Chunk.id).all()]
+    qrels = []
+    for cid in rng.sample(ids, min(n * 3, len(ids))):
+        chunk = db.session.get(Chunk, cid)
+        sentences = [s for s in split_sentences(chunk.text or "") if len(s.split()) >= 6]
+        if not sentences:
+            continue
+        question = rng.choice(sentences)
+        # Overlapping chunks can contain the same sentence; all of them count
+        relevant = [
+            rid for (rid,) in db.session.query(Chunk.id).filter(
+                Chunk.document_id == chunk.document_id, Chunk.text.contains(question, autoescape=True)
+            )
+        ]
+        qrels.append({"question": question, "doc_id": chunk.document_id, "relevant": relevant})
+        if len(qrels) >= n:
+            break
+    return qrels
+
+
+def evaluate(qrels: list, method: str, depth: int, k: int, scoped: bool) -> dict:
+    recalls, rr, latencies = [], [], []
+    for item in qrels:
+        relevant = set(item["relevant"])
+        start = time.perf_counter()
+        hits = retrieve(
+            item["question"],
+            top_k_bm25=depth,
+            top_k_faiss=depth,
+            top_n=k,
+            doc_id=item["doc_id"] if scoped else None,
+            use_cache=False,
+            fusion=method,
+        )
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        ranked = [cid for cid, _ in hits]
+        recalls.append(len(relevant & set(ranked)) / max(1, len(relevant)))
+        rr.append(next((1.0 / i for i, cid in enumerate(ranked, 1) if cid in relevant), 0.0))
+    return {
+        "method": method,
+        "depth": depth,
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        "mrr": round(float(np.mean(rr)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qrels", help="JSONL file of labelled questions")
+    parser.add_argument("--synthesize", type=int, default=0, help="synthesize N questions from stored chunks")
+    parser.add_argument("--methods", nargs="+", default=sorted(FUSERS))
+    parser.add_argument("--depths", type=int, nargs="+", default=[5, 10, 20])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--global", dest="scoped", action="store_false", help="search the whole corpus instead of the question's document")
+    parser.add_argument("--json", help="also write the rows to this file")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.qrels:
+            qrels = load_qrels(args.qrels)
+        elif args.synthesize:
+            qrels = synthesize_qrels(args.synthesize)
+        else:
+            parser.error("pass --qrels or --synthesize")
+        if not qrels:
+            raise SystemExit("No questions to evaluate.")
+
+        # Warm the model and index so the first row isn't charged for loading
+        retrieve(qrels[0]["question"], doc_id=qrels[0]["doc_id"], use_cache=False)
+
+        rows = [
+            evaluate(qrels, method, depth, args.k, args.scoped)
+            for method in args.methods
+            for depth in args.depths
+        ]
+
+    print(f"{len(qrels)} questions, k={args.k}, {'per-document' if args.scoped else 'global'} search")
+    cols = list(rows[0].keys())
+    print("  ".join(f"{c:>10}" for c in cols))
+    for row in rows:
+        print("  ".join(f"{str(row[c]):>10}" for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+# bench/hotpaths.py
+"""
+Offline benchmark of the ingestion, indexing, retrieval and generation hot paths.
+
+Each run works in a scratch directory: synthetic PDFs built with PyMuPDF,
+SQLite for the database, fakeredis for Redis and tiny randomly initialised
+checkpoints built on the fly, so no network or services are needed. The
+absolute numbers say little about production models; they are meant to be
+compared between commits on the same machine.
+
+    python -m bench.hotpaths --json results.json
+    python -m bench.hotpaths --docs 20 --pages 40 --encoder fake
+    python -m bench.hotpaths --json new.json --baseline old.json   # exit 1 on regressions
+
+Reported per phase: pages/s and chunks/s for extract_and_chunk, chunks
+embedded/s for embed_texts with a cold cache, incremental and full index
+build time, retrieve() and generate_answer() latency percentiles, and the
+resident set size at the end of each phase with its growth over the phase
+(rss_mb, rss_delta_mb). The process-wide RSS high-water mark, including the
+ingestion pool's children, is reported once under "process".
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+_SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+_SYLLABLES = ["ka", "lo", "mi", "ra", "te", "su", "no", "vi", "de", "pa", "ro", "li", "ne", "to", "ma", "se"]
+
+
+# Synthetic corpus
+def _vocabulary(size: int) -> list:
+    words = []
+    for a in _SYLLABLES:
+        for b in _SYLLABLES:
+            for c in _SYLLABLES:
+                words.append(a + b + c)
+    return words[:size]
+
+
+def _sentences(rng: np.random.Generator, vocab: list, n_words: int) -> str:
+    # Zipf-like word frequencies so BM25 sees common and rare terms
+    ranks = np.arange(1, len(vocab) + 1)
+    probs = (1.0 / ranks) / np.sum(1.0 / ranks)
+    words = rng.choice(vocab, size=n_words, p=probs)
+    out, start = [], 0
+    while start < n_words:
+        length = int(rng.integers(8, 20))
+        sentence = " ".join(words[start:start + length])
+        out.append(sentence[:1].upper() + sentence[1:] + ".")
+        start += length
+    return " ".join(out)
+
+
+def _make_pdf(path: str, rng: np.random.Generator, vocab: list, pages: int, words_per_page: int):
+    import fitz
+
+    pdf = fitz.open()
+    for _ in range(pages):
+        page = pdf.new_page()
+        text = _sentences(rng, vocab, words_per_page)
+        if page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=7) < 0:
+            raise SystemExit("Synthetic page text overflows the page; lower --words-per-page.")
+    pdf.save(path)
+    pdf.close()
+
+
+# Tiny checkpoints
+def _build_checkpoints(root: str, vocab: list, seed: int) -> tuple:
+    """Randomly initialised BERT encoder and BART generator sharing one word-level vocabulary."""
+    import torch
+    from transformers import (
+        BartConfig, BartForConditionalGeneration, BertConfig, BertModel, BertTokenizerFast,
+    )
+
+    torch.manual_seed(seed)
+    letters = [chr(c) for c in range(ord("a"), ord("z") + 1)] + [str(d) for d in range(10)]
+    tokens = _SPECIAL_TOKENS + list(".,;:!?-'()") + letters + ["##" + t for t in letters] + vocab
+    vocab_file = os.path.join(root, "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(tokens))
+
+    # BART takes no token_type_ids, so the generator's tokenizer must not emit them
+    embed_dir = os.path.join(root, "tiny-embed")
+    tokenizer = BertTokenizerFast(vocab_file, do_lower_case=True, model_max_length=512)
+    tokenizer.save_pretrained(embed_dir)
+    BertModel(BertConfig(
+        vocab_size=len(tokens), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=128, max_position_embeddings=512,
+    )).save_pretrained(embed_dir)
+
+    gen_dir = os.path.join(root, "tiny-gen")
+    tokenizer = BertTokenizerFast(
+        vocab_file, do_lower_case=True, model_max_length=1024,
+        model_input_names=["input_ids", "attention_mask"],
+    )
+    tokenizer.save_pretrained(gen_dir)
+    BartForConditionalGeneration(BartConfig(
+        vocab_size=len(tokens), d_model=64, encoder_layers=1, decoder_layers=1,
+        encoder_attention_heads=2, decoder_attention_heads=2,
+        encoder_ffn_dim=128, decoder_ffn_dim=128, max_position_embeddings=1024,
+        pad_token_id=0, bos_token_id=2, eos_token_id=3,
+        decoder_start_token_id=2, forced_eos_token_id=3,
+    )).save_pretrained(gen_dir)
+    return embed_dir, gen_dir
+
+
+def _fake_encode(texts, dim: int = 384) -> np.ndarray:
+    """Hashed bag-of-words vectors: deterministic, model-free, still topical."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            h = zlib.crc32(word.strip(".,;:!?").encode("utf-8"))
+            out[row, h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    return out
+
+
+# Environment
+def _configure(work: str, args) -> None:
+    """Point every path and service at the scratch directory; must run before app is imported."""
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + os.path.join(work, "bench.sqlite"),
+        "UPLOAD_FOLDER": os.path.join(work, "uploads"),
+        "WHOOSH_INDEX_DIR": os.path.join(work, "indexes", "whoosh_index"),
+        "FAISS_INDEX_DIR": os.path.join(work, "indexes", "faiss_index"),
+        "VECTOR_STORE_DIR": os.path.join(work, "indexes", "vectors"),
+        "INDEX_MANIFEST": os.path.join(work, "indexes", "manifest.json"),
+        "SENTENCE_INDEX_DIR": os.path.join(work, "indexes", "sentences"),
+        "INDEX_RELOAD_INTERVAL": "0",
+        "ONNX_CACHE_DIR": os.path.join(work, "onnx"),
+        "INGEST_ASYNC": "0",
+        "USE_RERANKER": "0",
+        "INGEST_PROCESSES": str(args.processes),
+        "EMBED_MODEL": args.embed_model,
+        "GENERATION_MODEL": args.gen_model,
+        "USE_GENERATOR": "0" if args.generator == "extractive" else "1",
+    })
+    os.makedirs(os.environ["UPLOAD_FOLDER"], exist_ok=True)
+
+    try:
+        import fakeredis
+        import redis
+    except ImportError:
+        raise SystemExit("The benchmark needs fakeredis as an in-memory Redis: pip install fakeredis")
+
+    # Every client the app creates shares one in-memory server
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeRedis(server=server, **kwargs)
+
+    redis.from_url = from_url
+    redis.Redis.from_url = staticmethod(from_url)
+
+
+def _rss_peak_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / scale, 1)
+
+
+def _rss_now_mb() -> float:
+    """Current resident set size from /proc; the high-water mark where that's unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return _rss_peak_mb()
+
+
+def _percentiles(latencies_ms: list) -> dict:
+    arr = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        "queries": len(arr),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+# Phases
+def run(work: str, args) -> dict:
+    from app import create_app, db
+    from app import embedder
+    from app.indexer import build_indexes, rebuild_indexes
+    from app.ingestion import extract_and_chunk
+    from app.models import Chunk, Document
+    from app.retriever import retrieve
+    from app.generator import generate_answer
+
+    if args.encoder == "fake":
+        embedder._encode_batch = _fake_encode
+
+    rng = np.random.default_rng(args.seed)
+    vocab = _vocabulary(args.vocab)
+    results = {}
+    rss_mark = [_rss_now_mb()]
+
+    def memory() -> dict:
+        # RSS now, and its growth since the previous phase ended
+        now = _rss_now_mb()
+        out = {"rss_mb": now, "rss_delta_mb": round(now - rss_mark[0], 1)}
+        rss_mark[0] = now
+        return out
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+
+        paths = []
+        for i in range(args.docs):
+            path = os.path.join(os.environ["UPLOAD_FOLDER"], f"bench-{i}.pdf")
+            _make_pdf(path, rng, vocab, args.pages, args.words_per_page)
+            doc = Document(filename=os.path.basename(path))
+            db.session.add(doc)
+            db.session.commit()
+            paths.append((doc.id, path))
+
+        # Model loads are one-off costs; keep them out of the timed phases
+        embedder.embed_texts(["warm up"])
+        embedder.redis_client.flushall()
+        memory()
+
+        start = time.perf_counter()
+        chunks = sum(extract_and_chunk(doc_id, path) for doc_id, path in paths)
+        elapsed = time.perf_counter() - start
+        pages = args.docs * args.pages
+        results["ingest"] = {
+            "docs": args.docs, "pages": pages, "chunks": chunks,
+            "seconds": round(elapsed, 3),
+            "pages_per_s": round(pages / elapsed, 2),
+            "chunks_per_s": round(chunks / elapsed, 2),
+            **memory(),
+        }
+
+        texts = [t for (t,) in db.session.query(Chunk.text).order_by(Chunk.id)]
+        embedder.redis_client.flushall()
+        start = time.perf_counter()
+        embedder.embed_texts(texts)
+        elapsed = time.perf_counter() - start
+        results["embed"] = {
+            "chunks": len(texts),
+            "seconds": round(elapsed, 3),
+            "chunks_per_s": round(len(texts) / elapsed, 2),
+            **memory(),
+        }
+
+        start = time.perf_counter()
+        for doc_id, _ in paths:
+            build_indexes(reindex_all=False, doc_id=doc_id)
+        results["index_incremental"] = {
+            "docs": len(paths),
+            "seconds": round(time.perf_counter() - start, 3),
+            **memory(),
+        }
+
+        start = time.perf_counter()
+        rebuild_indexes()
+        results["index_rebuild"] = {
+            "chunks": chunks,
+            "seconds": round(time.perf_counter() - start, 3),
+            **memory(),
+        }
+
+        # Questions are short spans of real chunk text, asked of their own document
+        rows = db.session.query(Chunk.document_id, Chunk.text).order_by(Chunk.id).all()
+        picks = rng.choice(len(rows), size=args.queries, replace=len(rows) < args.queries)
+        questions = []
+        for row in picks:
+            doc_id, text = rows[int(row)]
+            words = text.split()
+            at = int(rng.integers(0, max(1, len(words) - 6)))
+            questions.append((doc_id, " ".join(words[at:at + 6])))
+
+        # Both the warm-up pass and the timed pass skip the result cache;
+        # the query embedding cache is cleared so each query is encoded
+        for doc_id, question in questions[:5]:
+            retrieve(question, doc_id=doc_id, use_cache=False)
+        embedder.query_cache.clear_local()
+        embedder.redis_client.flushall()
+
+        for name, scoped in (("retrieve_doc", True), ("retrieve_global", False)):
+            latencies = []
+            for doc_id, question in questions:
+                start = time.perf_counter()
+                retrieve(question, doc_id=doc_id if scoped else None, use_cache=False)
+                latencies.append((time.perf_counter() - start) * 1000.0)
+            results[name] = {**_percentiles(latencies), **memory()}
+            embedder.query_cache.clear_local()
+            embedder.redis_client.flushall()
+
+        # First pass fills the result cache; the timed pass measures hits
+        for doc_id, question in questions:
+            retrieve(question, doc_id=doc_id)
+        latencies = []
+        for doc_id, question in questions:
+            start = time.perf_counter()
+            retrieve(question, doc_id=doc_id)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+        results["retrieve_cached"] = {**_percentiles(latencies), **memory()}
+
+        if args.generator != "off":
+            context = []
+            for doc_id, question in questions[:args.gen_queries]:
+                hits = retrieve(question, doc_id=doc_id)
+                by_id = {c.id: c for c in Chunk.query.filter(Chunk.id.in_([cid for cid, _ in hits]))}
+                context.append((question, [by_id[cid] for cid, _ in hits if cid in by_id]))
+
+            generate_answer(*context[0])
+            latencies = []
+            for question, chunks_used in context:
+                start = time.perf_counter()
+                generate_answer(question, chunks_used)
+                latencies.append((time.perf_counter() - start) * 1000.0)
+            results["generate"] = {**_percentiles(latencies), **memory()}
+
+        db.session.remove()
+    results["process"] = {"rss_peak_mb": _rss_peak_mb()}
+    return results
+
+
+# Regression check
+# Changes smaller than these are timer and allocator noise, whatever the ratio
+_NOISE_FLOOR = {"_ms": 0.5, "seconds": 0.05, "_mb": 16.0}
+
+
+def _lower_is_better(metric: str) -> bool:
+    return metric.endswith("_ms") or metric.endswith("_mb") or metric == "seconds"
+
+
+def _noise_floor(metric: str) -> float:
+    for suffix, floor in _NOISE_FLOOR.items():
+        if metric.endswith(suffix):
+            return floor
+    return 0.0
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Metrics that got worse than `baseline` by more than `tolerance` (a fraction)."""
+    regressions = []
+    for phase, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            old = baseline.get("results", {}).get(phase, {}).get(metric)
+            if not old or not (_lower_is_better(metric) or metric.endswith("_per_s")):
+                continue
+            change = (value - old) / old
+            if _lower_is_better(metric):
+                worse = change > tolerance and value - old > _noise_floor(metric)
+            else:
+                worse = change < -tolerance
+            print(f"{phase:18s} {metric:14s} {old:>12.3f} -> {value:>12.3f}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(f"{phase}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument("--words-per-page", type=int, default=350)
+    parser.add_argument("--vocab", type=int, default=3000, help="distinct words in the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--gen-queries", type=int, default=20)
+    parser.add_argument("--encoder", choices=("tiny", "fake"), default="tiny",
+                        help="tiny: random BERT checkpoint; fake: hashed bag-of-words, no torch in the loop")
+    parser.add_argument("--generator", choices=("tiny", "extractive", "off"), default="tiny")
+    parser.add_argument("--embed-model", help="local embedding checkpoint instead of the tiny one")
+    parser.add_argument("--gen-model", help="local generator checkpoint instead of the tiny one")
+    parser.add_argument("--processes", type=int, default=2, help="INGEST_PROCESSES")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="keep artifacts here instead of a temporary directory")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before flagging, as a fraction")
+    args = parser.parse_args()
+
+    # Recorded before the checkpoint paths are filled in, so runs stay comparable
+    run_args = {k: v for k, v in vars(args).items() if k not in ("json", "baseline", "workdir")}
+    work = args.workdir or tempfile.mkdtemp(prefix="hotpaths-")
+    os.makedirs(work, exist_ok=True)
+    embed_dir, gen_dir = _build_checkpoints(work, _vocabulary(args.vocab), args.seed)
+    args.embed_model = args.embed_model or embed_dir
+    args.gen_model = args.gen_model or gen_dir
+    _configure(work, args)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": run_args,
+        },
+        "results": run(work, args),
+    }
+
+    for phase, metrics in report["results"].items():
+        print(f"{phase:18s} " + "  ".join(f"{k}={v}" for k, v in metrics.items()))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("args") != report["meta"]["args"]:
+            print("Warning: baseline was run with different arguments.")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
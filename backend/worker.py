@@ -0,0 +1,12 @@
+# worker.py
+
+import logging
+
+from app import create_app
+from app.jobs import work, INGEST_WORKERS
+
+app = create_app()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    work(app, concurrency=INGEST_WORKERS)
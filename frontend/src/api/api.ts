@@ -11,13 +11,44 @@ export function uploadPdf(file: File, docName?: string) {
   const form = new FormData();
   form.append("file", file);
   if (docName) form.append("doc_name", docName);
-  return api.post<{ doc_id: number; chunks: any[]; message: string }>(
+  return api.post<{ doc_id: number; chunks?: any[]; job_id?: string; message: string }>(
     "/upload",
     form,
     { headers: { "Content-Type": "multipart/form-data" } }
   );
 }
 
+export type JobStatus = {
+  job_id: string;
+  status: "queued" | "running" | "extracting" | "indexing" | "done" | "failed";
+  pages_total?: number;
+  pages_parsed?: number;
+  chunks?: number;
+  chunks_embedded?: number;
+  unembedded?: number;
+  indexed?: boolean;
+  error?: string;
+};
+
+export function fetchJob(jobId: string) {
+  return api.get<JobStatus>(`/jobs/${jobId}`);
+}
+
+// Polls a background ingestion job until it finishes or fails
+export async function waitForJob(
+  jobId: string,
+  onProgress?: (job: JobStatus) => void,
+  intervalMs = 1000
+): Promise<JobStatus> {
+  for (;;) {
+    const { data } = await fetchJob(jobId);
+    onProgress?.(data);
+    if (data.status === "done") return data;
+    if (data.status === "failed") throw new Error(data.error || "Processing failed.");
+    await new Promise((r) => setTimeout(r, intervalMs));
+  }
+}
+
 export function fetchChunks(docId: number) {
   return api.get<Array<{chunk_id: number; page: number; preview: string;}>>(
     `/chunks/${docId}`
@@ -36,3 +67,49 @@ export function getPdfUrl(docId: number | string) {
 export function askQuestion(payload: { doc_id: number | string; question: string }) {
   return api.post<{ answer: string; citations?: Array<{ chunk_id: number; page?: number; preview?: string }> }>("/query", payload);
 }
+
+export type StreamHandlers = {
+  onCitations?: (citations: number[]) => void;
+  onToken?: (text: string) => void;
+};
+
+// POSTs to /query/stream and feeds Server-Sent Events to the handlers; resolves with the full answer
+export async function streamQuestion(
+  payload: { doc_id: number | string; question: string },
+  handlers: StreamHandlers = {}
+): Promise<string> {
+  const base = import.meta.env.VITE_BACKEND_URL || "http://localhost:5000";
+  const res = await fetch(`${base}/query/stream`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify(payload),
+  });
+  if (!res.ok || !res.body) {
+    const data = await res.json().catch(() => ({}));
+    throw new Error(data?.error || `Request failed with status ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let answer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep: number;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] ?? "{}");
+      if (event === "citations") handlers.onCitations?.(data.citations ?? []);
+      else if (event === "token") {
+        answer += data.text;
+        handlers.onToken?.(data.text);
+      } else if (event === "done") return data.answer ?? answer;
+      else if (event === "error") throw new Error(data.error || "Streaming failed.");
+    }
+  }
+  return answer;
+}
@@ -1,7 +1,7 @@
 // src/components/Chat.tsx
 import { useEffect, useMemo, useRef, useState } from "react";
 import { useSearchParams, Link } from "react-router-dom";
-import { askQuestion, fetchChunks, buildChatPath, getPdfUrl } from "../api/api";
+import { streamQuestion, fetchChunks, buildChatPath, getPdfUrl } from "../api/api";
 import * as React from "react";
 
 type Message = {
@@ -54,27 +54,26 @@ export function Chat() {
     setMessages((m) => [...m, { role: "user", content: q }]);
     setLoading(true);
 
+    // Placeholder assistant message that tokens are streamed into
+    setMessages((m) => [...m, { role: "assistant", content: "" }]);
+    const updateLast = (patch: (msg: Message) => Message) =>
+      setMessages((m) => [...m.slice(0, -1), patch(m[m.length - 1])]);
+
     try {
-      const { data } = await askQuestion({ doc_id: docId, question: q });
-      const answer = data?.answer ?? "No answer returned.";
-      const citations = Array.isArray(data?.citations)
-        ? data.citations.map((cid: any) =>
-            typeof cid === "number" ? { chunk_id: cid } : cid
-          )
-        : undefined;
-
-      setMessages((m) => [...m, { role: "assistant", content: answer, citations }]);
-    } catch (err: any) {
-      setMessages((m) => [
-        ...m,
+      const answer = await streamQuestion(
+        { doc_id: docId, question: q },
         {
-          role: "assistant",
-          content:
-            err?.response?.data?.error ||
-            err?.response?.data?.message ||
-            "Sorry—something went wrong while answering.",
-        },
-      ]);
+          onCitations: (ids) =>
+            updateLast((msg) => ({ ...msg, citations: ids.map((chunk_id) => ({ chunk_id })) })),
+          onToken: (text) => updateLast((msg) => ({ ...msg, content: msg.content + text })),
+        }
+      );
+      updateLast((msg) => ({ ...msg, content: answer || msg.content || "No answer returned." }));
+    } catch (err: any) {
+      updateLast((msg) => ({
+        ...msg,
+        content: err?.message || "Sorry—something went wrong while answering.",
+      }));
     } finally {
       setLoading(false);
     }
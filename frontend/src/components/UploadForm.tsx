@@ -2,7 +2,8 @@
 
 import { useState } from "react";
 import type { ChangeEvent, FormEvent } from "react";
-import { uploadPdf, fetchChunks } from "../api/api";
+import { uploadPdf, fetchChunks, waitForJob } from "../api/api";
+import type { JobStatus } from "../api/api";
 import { useNavigate } from "react-router-dom";
 import { buildChatPath } from "../api/api";
 
@@ -21,6 +22,26 @@ export function UploadForm() {
     { chunk_id: number; page: number; preview: string }[]
   >([]);
 
+  // Uploads the file and, for background ingestion, waits for the job to finish
+  const uploadAndProcess = async (): Promise<{ id: number; count: number }> => {
+    const resp = await uploadPdf(file as File, name || undefined);
+    const id = resp.data.doc_id;
+
+    if (resp.data.job_id) {
+      setStatus("Processing…");
+      const job = await waitForJob(resp.data.job_id, (j: JobStatus) => {
+        if (j.pages_total) {
+          setStatus(`Processing… ${j.pages_parsed ?? 0}/${j.pages_total} pages, ${j.chunks_embedded ?? 0} chunks embedded`);
+        }
+      });
+      return { id, count: job.chunks ?? 0 };
+    }
+
+    const rawChunks = resp.data.chunks;
+    const count = Array.isArray(rawChunks) ? rawChunks.length : rawChunks ?? 0;
+    return { id, count };
+  };
+
   const onFileChange = (e: ChangeEvent<HTMLInputElement>) =>
     setFile(e.target.files?.[0] ?? null);
 
@@ -35,10 +56,7 @@ export function UploadForm() {
     setStatus("Uploading…");
 
     try {
-      const resp = await uploadPdf(file, name || undefined);
-      const id = resp.data.doc_id;
-      const rawChunks = resp.data.chunks;
-      const count = Array.isArray(rawChunks) ? rawChunks.length : rawChunks;
+      const { id, count } = await uploadAndProcess();
 
       setDocId(id);
       setChunkCount(count);
@@ -73,10 +91,7 @@ export function UploadForm() {
       setLoading(true);
       setStatus("Uploading…");
 
-      const resp = await uploadPdf(file, name || undefined);
-      const id = resp.data.doc_id;
-      const rawChunks = resp.data.chunks;
-      const count = Array.isArray(rawChunks) ? rawChunks.length : rawChunks;
+      const { id, count } = await uploadAndProcess();
 
       setDocId(id);
       setChunkCount(count);